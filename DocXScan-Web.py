@@ -13,17 +13,114 @@ import tempfile
 import os
 import zipfile
 import pandas as pd
+import numpy as np
 from datetime import datetime
 from docx import Document
+from openpyxl import Workbook
 import json
 import shutil
 from pathlib import Path
 import threading
-from io import BytesIO
+import uuid
+from io import BytesIO, TextIOWrapper
 import base64
 import time
 import glob
+import itertools
 import platform
+import re
+import html
+import sqlite3
+import zlib
+import hashlib
+import heapq
+import logging
+from logging.handlers import RotatingFileHandler
+import csv
+import gzip
+import queue
+from collections import deque
+from types import SimpleNamespace
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is only offered when pyarrow is installed
+    pa = pq = None
+
+# WordprocessingML element names used by the streaming extractor
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY, W_P, W_R, W_T, W_HYPERLINK = W_NS + 'body', W_NS + 'p', W_NS + 'r', W_NS + 't', W_NS + 'hyperlink'
+W_TBL, W_TR, W_TC, W_TRPR, W_TCPR = W_NS + 'tbl', W_NS + 'tr', W_NS + 'tc', W_NS + 'trPr', W_NS + 'tcPr'
+W_GRID_BEFORE, W_GRID_SPAN, W_VMERGE, W_VAL = W_NS + 'gridBefore', W_NS + 'gridSpan', W_NS + 'vMerge', W_NS + 'val'
+W_BR, W_TYPE = W_NS + 'br', W_NS + 'type'
+W_RUN_TEXT = {W_NS + 'tab': '\t', W_NS + 'ptab': '\t', W_NS + 'cr': '\n', W_NS + 'noBreakHyphen': '-'}
+OFFICE_DOCUMENT_REL = '/officeDocument'
+
+# Raw document.xml prefilter: w:t text, and wrappers whose runs python-docx leaves out of paragraph text
+W_NS_DECL = b'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+W_T_TEXT = re.compile(rb'<w:t(?:\s[^>]*)?>([^<]*)</w:t>')
+W_SKIPPED_RUNS = re.compile(rb'<(?:w:(?:ins|moveTo|smartTag|customXml|sdt|fldSimple|bdo|dir|ruby|txbxContent)\b'
+                            rb'|mc:AlternateContent\b|!\[CDATA\[)')
+
+# Opt-in token syntax for pattern families; anything else is matched literally
+REGEX_TOKEN_PREFIX = 're:'  # re:PROMTINTO\w*\( is a Python regular expression
+WILDCARD_TOKEN_PREFIX = 'glob:'  # glob:PROMTINTO*( where * is any run of non-space characters, ? is one
+MAX_FAMILY_VARIANTS = 10  # Distinct concrete matches recorded per family and file
+MATCH_CHECK_CHARS = 65536  # Characters matched between checks of a per-file deadline
+
+# Scan engine defaults (overridden from the sidebar)
+DEFAULT_SCAN_OPTIONS = {
+    'extractor': 'xml',  # "xml" streams document.xml, "docx" builds a python-docx Document
+    'workers': 1,  # Worker processes; 1 scans on the script thread
+    'chunk_size': 8,  # Files handed to a worker per task
+    'cache_dir': None,  # Directory of the persistent extraction cache, None disables it
+    'cache_max_mb': 512,  # Size cap before least-recently-used entries are evicted
+    'manifest_dir': None,  # Directory of per-folder scan manifests, None disables them
+    'incremental': False,  # Only re-process files added or modified since the last scan
+    'index_dir': None,  # Directory of per-folder inverted token indexes
+    'use_index': False,  # Answer selections from the folder's token index when it covers them
+    'build_index': False,  # Rebuild the folder's token index from this scan's hits
+    'file_type': "Both (.docx and .dcp.docx)",  # File Types selection the scan was run with
+    'progress_interval': 0.25,  # Minimum seconds between progress/console refreshes
+    'progress_every': 0,  # Also refresh after this many files (0 = time-based only)
+    'first_hit': False,  # Stop reading each document at its first match (no counts or lines)
+    'prefilter': True,  # Skip documents whose raw document.xml cannot contain any token
+    'checkpoint_dir': None,  # Directory of resumable scan checkpoints, None disables them
+    'checkpoint_interval': 30,  # Seconds between checkpoints of a running scan
+    'discovery_workers': 8,  # Threads listing folders in parallel while the scan runs
+    'largest_first': True,  # Dispatch the largest files first so no big file is left for last
+    'file_timeout': 120,  # Seconds one document may take to extract before it is skipped (0 = no limit)
+    'max_xml_mb': 256,  # Largest decompressed document.xml that is extracted (0 = no limit)
+}
+
+# Bump whenever extraction output changes so cached line lists are invalidated
+EXTRACTOR_VERSION = "2"
+DOCXSCAN_HOME = os.environ.get('DOCXSCAN_HOME') or os.path.join(os.path.expanduser("~"), ".docxscan")
+DEFAULT_CACHE_DIR = os.environ.get('DOCXSCAN_CACHE_DIR') or os.path.join(DOCXSCAN_HOME, "cache")
+DEFAULT_MANIFEST_DIR = os.path.join(DOCXSCAN_HOME, "manifests")
+DEFAULT_INDEX_DIR = os.path.join(DOCXSCAN_HOME, "index")
+DEFAULT_CHECKPOINT_DIR = os.path.join(DOCXSCAN_HOME, "checkpoints")
+DEFAULT_RESULTS_DIR = os.path.join(DOCXSCAN_HOME, "results")
+DEFAULT_EXPORTS_DIR = os.path.join(DOCXSCAN_HOME, "exports")
+EXCEL_MAX_ROWS = 1048576  # Rows an Excel worksheet can hold, header included
+PARQUET_BATCH_ROWS = 10000  # Rows buffered per Parquet row group
+DEFAULT_LOG_PATH = os.path.join(DOCXSCAN_HOME, "logs", "docxscan.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024  # Size at which the log file rotates
+LOG_BACKUPS = 5  # Rotated log files kept
+CONSOLE_LINES = 200  # Console lines a session keeps; older ones are only in the log file
+JOB_MESSAGE_LIMIT = 500  # Console lines a background job holds for its session to collect
+RESULTS_MAX_AGE = 7 * 24 * 3600  # Result stores untouched this long are purged
+EXPORTS_MAX_AGE = 24 * 3600  # Export files older than this are purged; a live session builds them again on demand
+SWEEP_INTERVAL = 600  # Seconds between sweeps of old result stores and export files while the server runs
+RESULTS_PAGE_SIZE = 1000  # Rows per page of the results table
+DOC_COUNT_TTL = 300  # Seconds a folder browser document count is reused
+DOC_COUNT_BUDGET = 0.1  # Seconds a folder browser count may hold up a rerun before showing a partial count
+WATCH_INTERVAL = 10  # Seconds between polls of a watched folder
+WATCH_DEBOUNCE = 3  # Seconds a changed file must stay unchanged before it is processed
+WATCH_QUEUE_LIMIT = 500  # Changed files a watcher holds at once; older ones are left to the next scan
 
 # Configure Streamlit page
 st.set_page_config(
@@ -764,25 +861,98 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+logger = logging.getLogger("docxscan")
+
+@st.cache_resource
+def setup_file_log():
+    """Send every console message to a rotating log file, once per server process"""
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        os.makedirs(os.path.dirname(DEFAULT_LOG_PATH), exist_ok=True)
+        handler = RotatingFileHandler(DEFAULT_LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                      encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+    except OSError:
+        handler = logging.NullHandler()
+    logger.addHandler(handler)
+    return logger
+
+def message_level(message):
+    """Log level implied by a console message's leading emoji"""
+    text = message.split('] ', 1)[-1] if message.startswith('[') else message
+    if text.startswith('❌'):
+        return logging.ERROR
+    if text.startswith('⚠️'):
+        return logging.WARNING
+    return logging.INFO
+
+class ConsoleLog:
+    """A session's console lines, with their levels, in a ring buffer of CONSOLE_LINES"""
+    
+    LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+    
+    def __init__(self, lines=(), limit=CONSOLE_LINES):
+        self.entries = deque(maxlen=limit)
+        self.level = logging.INFO
+        for line in lines:
+            self.add(line)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def add(self, line, level=None):
+        """Append an already timestamped line"""
+        self.entries.append((message_level(line) if level is None else level, line))
+    
+    def clear(self, line):
+        self.entries.clear()
+        self.add(line)
+    
+    def lines(self, limit=None):
+        """The most recent lines at or above the console level, oldest first"""
+        visible = [line for level, line in self.entries if level >= self.level]
+        return visible[-limit:] if limit else visible
+    
+    def render(self, placeholder, limit=None):
+        """Draw the console into a placeholder"""
+        console_text = html.escape('\n'.join(self.lines(limit)), quote=False)
+        placeholder.markdown(f'<div class="console-area">{console_text}</div>', unsafe_allow_html=True)
+
+def session_owner():
+    """ID of this browser tab, kept in the URL so it survives a page reload"""
+    owner = st.query_params.get("owner", "")
+    if not (owner.isalnum() and len(owner) <= 32):
+        owner = uuid.uuid4().hex[:16]
+        st.query_params["owner"] = owner
+    return owner
+
 class SessionState:
     """Manage session state variables"""
     @staticmethod
     def init():
+        setup_file_log()
+        if 'owner' not in st.session_state:
+            st.session_state.owner = session_owner()
         if 'token_map' not in st.session_state:
             st.session_state.token_map = {}
-        if 'scan_results' not in st.session_state:
-            st.session_state.scan_results = []
+        if 'result_store' not in st.session_state:
+            st.session_state.result_store = None
         if 'scan_progress' not in st.session_state:
             st.session_state.scan_progress = 0
         if 'scan_status' not in st.session_state:
             st.session_state.scan_status = "Ready to scan"
         if 'scan_running' not in st.session_state:
             st.session_state.scan_running = False
-        if 'console_messages' not in st.session_state:
-            st.session_state.console_messages = ["[READY] DocXScan v3.0 initialized", 
-                                                "[READY] Upload token file to begin"]
-        if 'matching_files' not in st.session_state:
-            st.session_state.matching_files = []
+        if 'scan_job_id' not in st.session_state:
+            st.session_state.scan_job_id = None
+        if 'scan_job_cursor' not in st.session_state:
+            st.session_state.scan_job_cursor = 0
+        if 'scan_notice' not in st.session_state:
+            st.session_state.scan_notice = None
+        if 'console' not in st.session_state:
+            st.session_state.console = ConsoleLog(["[READY] DocXScan v3.0 initialized", 
+                                                   "[READY] Upload token file to begin"])
         if 'selected_folder_path' not in st.session_state:
             st.session_state.selected_folder_path = ""
         if 'folder_browser_mode' not in st.session_state:
@@ -791,318 +961,3023 @@ class SessionState:
             st.session_state.path_history = []
         if 'current_path_input' not in st.session_state:
             st.session_state.current_path_input = ""
+        if 'cache_stats' not in st.session_state:
+            st.session_state.cache_stats = {'hits': 0, 'misses': 0}
+        if 'token_matrix' not in st.session_state:
+            st.session_state.token_matrix = None
+        if 'prefilter_rejected' not in st.session_state:
+            st.session_state.prefilter_rejected = 0
+        if 'budget_skipped' not in st.session_state:
+            st.session_state.budget_skipped = 0
+        if 'export_artifacts' not in st.session_state:
+            st.session_state.export_artifacts = ExportArtifacts()
 
-class DocumentScanner:
-    """Core document scanning functionality"""
+class TokenMatcher:
+    """Aho-Corasick automaton for literal tokens plus one regex alternation for re:/glob: families"""
+    
+    def __init__(self, patterns, extra_tokens=()):
+        self.patterns = list(patterns)
+        # Extra tokens are matched but not reported; empty tokens would match everywhere
+        self.tokens = list(dict.fromkeys(p for p in self.patterns + list(extra_tokens)
+                                         if p and p not in (REGEX_TOKEN_PREFIX, WILDCARD_TOKEN_PREFIX)))
+        self.families = [token for token in self.tokens if TokenMatcher.family_regex(token) is not None]
+        self.literals = [token for token in self.tokens if TokenMatcher.family_regex(token) is None]
+        self._lengths = [len(token) for token in self.literals]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        
+        self._families = None
+        self._family_res = []
+        self._solo_families = []  # Indexes of families searched outside the alternation
+        grouped = []
+        for i, family in enumerate(self.families):
+            source = TokenMatcher.family_regex(family)
+            try:
+                pattern = re.compile(source)
+            except re.error:
+                pattern = None  # Reported by token_error; never matches
+            self._family_res.append(pattern)
+            if pattern is None:
+                continue
+            if pattern.groups == 0 and TokenMatcher._fits_group(source):
+                grouped.append(i)
+            else:
+                self._solo_families.append(i)
+        if grouped:
+            try:
+                self._families = re.compile('|'.join(
+                    f"(?P<f{i}>{TokenMatcher.family_regex(self.families[i])})" for i in grouped
+                ))
+            except re.error:
+                self._solo_families = sorted(self._solo_families + grouped)
+        
+        # Build the trie
+        for idx, token in enumerate(self.literals):
+            state = 0
+            for ch in token:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][ch] = nxt
+                state = nxt
+            self._out[state] += (idx,)
+        
+        # Breadth-first failure links so overlapping tokens (jfig inside <<jfig) are reported
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0) if state else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+        
+        # While idle at the root, jump straight to the next possible token start
+        first_chars = sorted(self._goto[0])
+        self._skip = re.compile('[' + ''.join(re.escape(ch) for ch in first_chars) + ']') if first_chars else None
+        self.prefilter = DocumentPrefilter([TokenMatcher.required_text(token) for token in self.tokens])
     
     @staticmethod
-    def extract_full_text_lines(doc):
-        """Extract text from document"""
-        lines = []
+    def family_regex(token):
+        """Regex source for a re: or glob: token, or None for a literal token"""
+        if token.startswith(REGEX_TOKEN_PREFIX):
+            return token[len(REGEX_TOKEN_PREFIX):]
+        if token.startswith(WILDCARD_TOKEN_PREFIX):
+            body = token[len(WILDCARD_TOKEN_PREFIX):]
+            source = ''
+            for i, ch in enumerate(body):
+                if ch == '*':
+                    # Lazy inside the pattern so PROMTINTO*( stops at the first "(", greedy at the end
+                    source += r'\S*' if i == len(body) - 1 else r'\S*?'
+                elif ch == '?':
+                    source += r'\S'
+                else:
+                    source += re.escape(ch)
+            return source
+        return None
+    
+    @staticmethod
+    def required_text(token):
+        """Literal text every match of the token contains, or None if it cannot be known"""
+        if token.startswith(REGEX_TOKEN_PREFIX):
+            return None
+        if token.startswith(WILDCARD_TOKEN_PREFIX):
+            return max(re.split(r'[*?]', token[len(WILDCARD_TOKEN_PREFIX):]), key=len)
+        return token
+    
+    @staticmethod
+    def _fits_group(source):
+        """Whether a regex keeps its meaning wrapped in a group of the family alternation"""
         try:
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    lines.append(para.text)
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            lines.append(cell.text)
-        except Exception as e:
-            lines.append(f"Error extracting text: {str(e)}")
-        return lines
+            re.compile(f"(?:{source})")
+        except re.error:
+            return False  # e.g. a global (?i) that must start the whole pattern
+        return True
     
     @staticmethod
-    def scan_documents(folder_path, patterns, file_filter, progress_placeholder, console_placeholder):
-        """Main document scanning logic"""
+    def token_error(token):
+        """Why a re: token does not compile, or None if the token is usable"""
+        source = TokenMatcher.family_regex(token)
+        if source is None:
+            return None
         try:
-            matching_files = []
-            metadata = []
-            
-            # Log start
-            log_message("🔍 Starting document scan...", console_placeholder)
-            log_message(f"📂 Folder: {os.path.basename(folder_path)}", console_placeholder)
-            log_message(f"🎯 Patterns: {', '.join(patterns[:3])}{'...' if len(patterns) > 3 else ''}", console_placeholder)
-            
-            # Collect all files
-            all_files = []
-            for root_dir, _, files in os.walk(folder_path):
-                for file in files:
-                    if file_filter(file) and not file.startswith('~'):
-                        full_path = os.path.join(root_dir, file)
-                        if os.path.exists(full_path):
-                            all_files.append(full_path)
-            
-            if not all_files:
-                log_message("❌ No files found to scan", console_placeholder)
-                return [], []
-            
-            log_message(f"📄 Found {len(all_files)} files to process", console_placeholder)
+            re.compile(source)
+        except re.error as e:
+            return str(e)
+        return None
+    
+    def search(self, text, budget=None):
+        """Return per-literal-token occurrence counts and the line numbers they occur on"""
+        counts = [0] * len(self.literals)
+        token_lines = [[] for _ in self.literals]
+        if self._skip is None:
+            return counts, token_lines
+        
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        next_start = [0] * len(self.literals)
+        line_no = 0
+        line_pos = 0
+        state = 0
+        pos = 0
+        length = len(text)
+        next_check = MATCH_CHECK_CHARS if budget else length
+        
+        while pos < length:
+            if pos >= next_check:
+                budget.check_time()
+                next_check = pos + MATCH_CHECK_CHARS
+            if not state:
+                found = self._skip.search(text, pos)
+                if found is None:
+                    break
+                pos = found.start()
+            ch = text[pos]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
             
-            # Process files
-            for i, full_path in enumerate(all_files):
-                try:
-                    progress = int((i / len(all_files)) * 100)
-                    filename = os.path.basename(full_path)
-                    
-                    # Update progress
-                    st.session_state.scan_progress = progress
-                    st.session_state.scan_status = f"Processing {filename[:20]}..."
-                    progress_placeholder.progress(progress / 100)
-                    
-                    # Process document
-                    doc = Document(full_path)
-                    full_text = '\n'.join(DocumentScanner.extract_full_text_lines(doc))
-                    matched = []
-                    matched_lines = []
-                    
-                    # Check for patterns
-                    for token in patterns:
-                        if token in full_text:
-                            matched.append(token)
-                            # Find matching lines
-                            for line in full_text.split('\n'):
-                                if token in line and line.strip():
-                                    matched_lines.append(line.strip()[:100])  # Limit line length
-                    
-                    if matched:
-                        matching_files.append(full_path)
-                        
-                        # Get file info
-                        try:
-                            info = os.stat(full_path)
-                            file_size = info.st_size
-                            creation_date = datetime.fromtimestamp(info.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-                            modified_date = datetime.fromtimestamp(info.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                        except Exception:
-                            file_size = 0
-                            creation_date = "Unknown"
-                            modified_date = "Unknown"
-                        
-                        token_count = sum(full_text.count(token) for token in matched)
-                        
-                        metadata.append({
-                            'File Name': filename,
-                            'File Path': full_path,
-                            'Size (bytes)': file_size,
-                            'Creation Date': creation_date,
-                            'Modified Date': modified_date,
-                            'Matched Pattern(s)': ', '.join(matched),
-                            'Matched Line(s)': ' | '.join(matched_lines[:3]),  # Limit to 3 lines
-                            'Token Match Count': token_count
-                        })
-                        
-                        log_message(f"✅ Match found: {filename}", console_placeholder)
+            for idx in out[state]:
+                start = pos - lengths[idx] + 1
+                # Count non-overlapping occurrences, the same way str.count does
+                if start < next_start[idx]:
+                    continue
+                next_start[idx] = pos + 1
+                counts[idx] += 1
                 
-                except Exception as e:
-                    log_message(f"❌ Error processing {filename}: {str(e)}", console_placeholder)
-                
-                # Small delay to allow UI updates
-                time.sleep(0.01)
-            
-            # Complete
-            st.session_state.scan_progress = 100
-            st.session_state.scan_status = "Scan completed!"
-            progress_placeholder.progress(1.0)
-            
-            if matching_files:
-                log_message(f"🎉 Scan complete! Found {len(matching_files)} matching files", console_placeholder)
-            else:
-                log_message("ℹ️ No matching files found", console_placeholder)
-            
-            return matching_files, metadata
-            
-        except Exception as e:
-            log_message(f"❌ Scan failed: {str(e)}", console_placeholder)
-            return [], []
+                # A longer token ending here can start before the last hit; never count back
+                if start > line_pos:
+                    line_no += text.count('\n', line_pos, start)
+                    line_pos = start
+                if '\n' not in self.literals[idx] and (not token_lines[idx] or token_lines[idx][-1] != line_no):
+                    token_lines[idx].append(line_no)
+            pos += 1
+        
+        return counts, token_lines
+    
+    def first_match(self, lines, budget=None):
+        """Return the first token found in the lines, reading no further than needed"""
+        if self._skip is None and self._families is None and not self._solo_families:
+            return None
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, line in enumerate(lines):
+            if budget:
+                budget.check_time()
+            if self._families is not None:
+                for found in self._families.finditer(line):
+                    if found.end() > found.start():
+                        return self.families[int(found.lastgroup[1:])]
+            for idx in self._solo_families:
+                for found in self._family_res[idx].finditer(line):
+                    if found.end() > found.start():
+                        return self.families[idx]
+            if self._skip is None:
+                continue
+            text = line if i == 0 else '\n' + line
+            pos = 0
+            length = len(text)
+            while pos < length:
+                if not state:
+                    found = self._skip.search(text, pos)
+                    if found is None:
+                        break
+                    pos = found.start()
+                ch = text[pos]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                if out[state]:
+                    return self.literals[out[state][0]]
+                pos += 1
+        return None
+    
+    def search_families(self, text, budget=None):
+        """Return {family: (count, line numbers, variants)} for the families found in the text"""
+        found = {}
+        if self._families is None and not self._solo_families:
+            return found
+        candidates = []
+        line_no = 0
+        line_pos = 0
+        for match in self._families.finditer(text) if self._families is not None else ():
+            start = match.start()
+            if match.end() == start:
+                continue  # An empty match says nothing about the document
+            line_no += text.count('\n', line_pos, start)
+            line_pos = start
+            if not candidates or candidates[-1] != line_no:
+                candidates.append(line_no)
+        if not candidates and not self._solo_families:
+            return found
+        
+        text_lines = text.split('\n')
+        for idx, (family, pattern) in enumerate(zip(self.families, self._family_res)):
+            if pattern is None:
+                continue
+            count = 0
+            line_nos = []
+            variants = {}
+            # Families outside the alternation have no candidate lines, so every line is searched
+            for line_no in range(len(text_lines)) if idx in self._solo_families else candidates:
+                if budget:
+                    budget.check_time()
+                matched = False
+                for match in pattern.finditer(text_lines[line_no]):
+                    if match.end() == match.start():
+                        continue
+                    count += 1
+                    matched = True
+                    if len(variants) < MAX_FAMILY_VARIANTS:
+                        variants[match.group()] = None
+                if matched:
+                    line_nos.append(line_no)
+            if count:
+                found[family] = (count, line_nos, list(variants))
+        return found
+    
+    def find_hits(self, lines, budget=None):
+        """Match extracted lines, returning {token: (count, matched lines)}; family hits add their variants"""
+        full_text = '\n'.join(lines)
+        counts, token_lines = self.search(full_text, budget)
+        found = [(token, counts[idx], token_lines[idx], None) for idx, token in enumerate(self.literals) if counts[idx]]
+        found += [(family, count, line_nos, variants)
+                  for family, (count, line_nos, variants) in self.search_families(full_text, budget).items()]
+        
+        hits = {}
+        text_lines = full_text.split('\n') if found else None
+        for token, count, line_nos, variants in found:
+            matched_lines = []
+            for line_no in line_nos:
+                line = text_lines[line_no].strip()
+                if line:
+                    matched_lines.append(line[:100])  # Limit line length
+            hits[token] = (count, matched_lines) if variants is None else (count, matched_lines, variants)
+        return hits
+    
+    def matched_tokens(self, hits):
+        """The selected tokens that have hits, in selection order"""
+        return [token for token in self.patterns if token in hits]
+    
+    def summarize(self, hits):
+        """Collapse per-token hits into matched patterns, matched lines and total count"""
+        matched = []
+        matched_lines = []
+        token_count = 0
+        for token in self.patterns:
+            if token in hits:
+                count, lines, *variants = hits[token]
+                # Families are reported with the concrete variants they matched
+                matched.append(f"{token} [{', '.join(variants[0])}]" if variants else token)
+                matched_lines.extend(lines)
+                token_count += count
+        return matched, matched_lines, token_count
 
-def log_message(message, console_placeholder=None):
-    """Add message to console log"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    formatted_msg = f"[{timestamp}] {message}"
-    st.session_state.console_messages.append(formatted_msg)
-    
-    # Keep only last 30 messages
-    if len(st.session_state.console_messages) > 30:
-        st.session_state.console_messages = st.session_state.console_messages[-30:]
-    
-    # Update console display if placeholder provided
-    if console_placeholder:
-        console_text = '\n'.join(st.session_state.console_messages)
-        console_placeholder.markdown(
-            f'<div class="console-area">{console_text}</div>',
-            unsafe_allow_html=True
-        )
+class DocumentPrefilter:
+    """Cheap test on raw document.xml bytes that rules out documents no token can match"""
+    
+    def __init__(self, tokens):
+        # Fragments avoid characters that come from markup (tabs, breaks, non-breaking
+        # hyphens) and are searched in w:t text joined without separators
+        # A None token (a regex family) has no known text and disables the filter
+        fragments = [max(re.split(r'[\t\n-]', token), key=len) if token is not None else '' for token in tokens]
+        self.enabled = bool(fragments) and all(fragments)
+        self._pattern = None
+        if self.enabled:
+            alternatives = sorted(set(fragments), key=len, reverse=True)
+            self._pattern = re.compile('|'.join(re.escape(fragment) for fragment in alternatives))
+    
+    def may_match(self, data):
+        """False only when no token can occur in the text extracted from this document.xml"""
+        # Runs python-docx skips, or an unexpected layout, always pass
+        if not self.enabled or W_NS_DECL not in data or W_SKIPPED_RUNS.search(data):
+            return True
+        try:
+            text = html.unescape(b''.join(W_T_TEXT.findall(data)).decode('utf-8'))
+        except UnicodeDecodeError:
+            return True
+        return self._pattern.search(text) is not None
 
-def clear_console():
-    """Clear console messages"""
-    st.session_state.console_messages = ["[READY] Console cleared"]
+class ExtractionCache:
+    """Persistent SQLite cache of extracted line lists keyed by path, size, mtime and extractor version"""
+    
+    DB_NAME = "extraction_cache.sqlite3"
+    
+    def __init__(self, cache_dir, max_mb=512):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        self.conn = sqlite3.connect(os.path.join(cache_dir, self.DB_NAME), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS lines (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                data BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS lines_last_used ON lines (last_used)")
+        self.conn.commit()
+    
+    def get(self, path, size, mtime_ns, version):
+        """Return cached lines for an unchanged file, or None"""
+        try:
+            row = self.conn.execute(
+                "SELECT data FROM lines WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ?",
+                (path, size, mtime_ns, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE lines SET last_used = ? WHERE path = ?", (time.time(), path))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(zlib.decompress(row[0]))
+        except (sqlite3.Error, zlib.error, ValueError):
+            self.misses += 1
+            return None
+    
+    def put(self, path, size, mtime_ns, version, lines):
+        """Store extracted lines, evicting old entries once the size cap is reached"""
+        data = zlib.compress(json.dumps(lines).encode('utf-8'))
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, version, data, len(data), time.time())
+            )
+            self.conn.commit()
+        except sqlite3.Error:
+            return
+        
+        # Summing the table on every write would be quadratic, so evict in batches
+        self._written += len(data)
+        if self._written >= self.max_bytes // 20:
+            self.evict()
+    
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits its size cap"""
+        self._written = 0
+        try:
+            total = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM lines").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes
+            victims = []
+            for path, nbytes in self.conn.execute("SELECT path, nbytes FROM lines ORDER BY last_used"):
+                victims.append((path,))
+                excess -= nbytes
+                if excess <= 0:
+                    break
+            self.conn.executemany("DELETE FROM lines WHERE path = ?", victims)
+            self.conn.commit()
+        except sqlite3.Error:
+            pass
+    
+    def stats(self):
+        """Return (entries, total bytes) currently stored"""
+        try:
+            return self.conn.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM lines").fetchone()
+        except sqlite3.Error:
+            return 0, 0
+    
+    def clear(self):
+        """Remove every cached entry"""
+        self.conn.execute("DELETE FROM lines")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+    
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
 
-def create_template():
-    """Create token template JSON"""
-    template = {
-        "<<FileService.": "Fileservice",
-        "</ff>": "Page Break",
-        "</pp>": "Hard Return",
-        "<backspace>": "Backspace",
-        "<<STNDRDTH": "STNDRD Add \"TH\"",
-        "<c>": "Center",
-        "<u>": "Underline",
-        "<i>": "Italic",
-        "<pcase>": "pcase",
-        "<lcase>": "lcase",
-        "<ucase>": "ucase",
-        "<bold>": "Bold",
-        "<nobullet>": "No Bullet",
-        "<fontsize": "Font Size",
-        "<s1>": "s1",
-        "<s2>": "s2",
-        "[[MCOMPUTEINTO(<<": "MCOMPUTE INTO",
-        "[[SCOMPUTEINTO(": "SCOMPUTE INTO",
-        "[[ABORTIIF": "Abortif",
-        "PROMTINTO(": "PROMTINTO",
-        "PROMTINTOIIF(": "PROMTINTOIIF",
-        "PROMTINTOLIST(": "PROMTINTOLIST",
-        "PROMTINTOIIFLIST(": "PROMTINTOIIFLIST",
-        "PROMTFORM(": "PROMTFORM",
-        "<<Checklist.": "CHECKLIST",
-        "TABLE(": "TABLE",
-        "<<jfig": "JFIG",
-        "jfig": "JFIG_General",
-        "{ATTY": "ESIGN",
-        "<<Special.": "SPECIAL",
-        "+91|<<Special.ToDay": "+91 special day",
-        "-91|<<Special.ToDay": "-91 special day",
-        "+2|<<Special.ToDay": "+2 special day",
-        "-2|<<Special.ToDay": "-2 special day",
-        "<<Tracker.MortDate>>~MMMM dd": "MMMM dd,yyyy",
-        "<<Tracker.MortDate>>~MM-dd-yyyy": "MM-dd-yyyy",
-        "<<Tracker.MortDate>>~ddd": "ddd,MMM dd-yyyy",
-        "<<Tracker.OriginalPrincipal>>~##": "##,###,###.00",
-        "CU$TOMMMMMMPLACEHOLDER": "Custom(Enter Below)"
-    }
+class ScanManifest:
+    """Per-folder record of file fingerprints and token hits from the last scan"""
     
-    return json.dumps(template, indent=2)
+    VERSION = 2
+    
+    def __init__(self, path, tokens=(), files=None):
+        self.path = path
+        self.tokens = list(tokens)
+        self.files = files or {}
+    
+    @classmethod
+    def load(cls, manifest_dir, folder_path):
+        """Load the manifest for a folder, or an empty one if missing or stale"""
+        path = os.path.join(manifest_dir, f"{folder_key(folder_path)}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == cls.VERSION and data.get('extractor') == EXTRACTOR_VERSION:
+                return cls(path, data['tokens'], data['files'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls(path)
+    
+    def covers(self, tokens):
+        """Whether stored hits are complete for every given token"""
+        return bool(self.files) and set(tokens) <= set(self.tokens)
+    
+    def unchanged_entry(self, full_path, info):
+        """Return the stored entry if the file is unchanged since it was recorded"""
+        entry = self.files.get(full_path)
+        if entry is None or entry['size'] != info.st_size:
+            return None
+        if entry['mtime_ns'] != info.st_mtime_ns:
+            # Touched but possibly identical, so compare content before re-processing
+            if not entry.get('sha1') or file_sha1(full_path) != entry['sha1']:
+                return None
+        return {**entry, 'mtime_ns': info.st_mtime_ns, 'ctime': info.st_ctime, 'mtime': info.st_mtime}
+    
+    def save(self, tokens, files):
+        """Atomically write the manifest with the given tokens and file entries"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {
+            'version': self.VERSION,
+            'extractor': EXTRACTOR_VERSION,
+            'tokens': list(tokens),
+            'files': files
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self.tokens = list(tokens)
+        self.files = files
 
-def create_zip_download(matching_files, metadata, zip_name="matched_files"):
-    """Create ZIP file for download"""
-    try:
-        zip_buffer = BytesIO()
+class ScanCheckpoint:
+    """Progress of an unfinished scan of a folder, saved periodically so it can be resumed"""
+    
+    VERSION = 4
+    
+    def __init__(self, checkpoint_dir, folder_path, owner=None):
+        # Each browser tab resumes only its own scans of a folder
+        name = f"{folder_key(folder_path)}_{owner}" if owner else folder_key(folder_path)
+        self.path = os.path.join(checkpoint_dir, f"{name}.json")
+        self.kind = "scan"
+        self.patterns = []
+        self.file_type = DEFAULT_SCAN_OPTIONS['file_type']
+        self.matrix = False
+        self.options = {}
+        self.files = []
+        self.order = None
+        self.done = set()
+        self.results_path = None
+        self.results_size = 0
+        self.results_skipped = []
+        self.entries = {}
+        self.saved_at = None
+    
+    @classmethod
+    def load(cls, checkpoint_dir, folder_path, owner=None):
+        """Load the owner's checkpoint for the folder, or None if there is no usable one"""
+        checkpoint = cls(checkpoint_dir, folder_path, owner)
+        try:
+            with open(checkpoint.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION or data.get('extractor') != EXTRACTOR_VERSION:
+                return None
+            checkpoint.kind = data['kind']
+            checkpoint.patterns = data['patterns']
+            checkpoint.file_type = data['file_type']
+            checkpoint.matrix = data['matrix']
+            checkpoint.options = data['options']
+            checkpoint.files = data['files']
+            checkpoint.order = data['order']
+            checkpoint.done = set(range(data['cursor'])) | set(data['done'])
+            checkpoint.results_path = data['results']['path']
+            checkpoint.results_size = data['results']['size']
+            checkpoint.results_skipped = data['results']['skipped']
+            checkpoint.entries = data['entries']
+            checkpoint.saved_at = data['saved_at']
+        except (OSError, ValueError, KeyError):
+            return None
+        if not os.path.exists(checkpoint.results_path):
+            return None
+        return checkpoint
+    
+    def save(self, job, options, files, done, results, entries, order=None):
+        """Atomically write the scan's progress so far"""
+        cursor = 0
+        while cursor in done:
+            cursor += 1
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {
+            'version': self.VERSION,
+            'extractor': EXTRACTOR_VERSION,
+            'kind': job.kind,
+            'patterns': job.patterns,
+            'file_type': job.file_type,
+            'matrix': job.matrix,
+            'options': options,
+            'files': files,
+            'order': order,
+            'cursor': cursor,
+            'done': sorted(index for index in done if index > cursor),
+            'results': {'path': results.path, 'size': results.flush(), 'skipped': results.skipped},
+            'entries': entries,
+            'saved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+    
+    def discard(self):
+        """Remove the checkpoint once its scan has finished"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class TokenIndex:
+    """Inverted token -> files index of a folder, answering token queries without reading documents"""
+    
+    # Postings store the hit after its count as JSON, [lines] or [lines, variants] for families
+    FORMAT = "2"
+    
+    def __init__(self, index_dir, folder_path):
+        os.makedirs(index_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(index_dir, f"{folder_key(folder_path)}.sqlite3"), timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                ordinal INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                ctime REAL NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                lines TEXT NOT NULL,
+                PRIMARY KEY (token, ordinal)
+            ) WITHOUT ROWID;
+        """)
+    
+    @staticmethod
+    def exists(index_dir, folder_path):
+        """Whether an index has been built for the folder"""
+        return os.path.exists(os.path.join(index_dir, f"{folder_key(folder_path)}.sqlite3"))
+    
+    def rebuild(self, tokens, entries, file_type, unreadable=()):
+        """Replace the index with (path, manifest entry) pairs in walk order, plus the files that could not be read"""
+        # Unreadable files are recorded so stale_reason does not take them for new ones
+        unreadable_files = []
+        for full_path in unreadable:
+            try:
+                info = os.stat(full_path)
+                unreadable_files.append([full_path, info.st_size, info.st_mtime])
+            except OSError:
+                pass
+        with self.conn:
+            self.conn.execute("DELETE FROM meta")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM postings")
+            for ordinal, (full_path, entry) in enumerate(entries):
+                self.conn.execute(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                    (ordinal, full_path, entry['size'], entry['ctime'], entry['mtime'])
+                )
+                self.conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?, ?)",
+                    [(token, ordinal, hit[0], json.dumps(list(hit[1:]))) for token, hit in entry['hits'].items()]
+                )
+            self.conn.execute("INSERT INTO meta VALUES ('tokens', ?)", (json.dumps(list(tokens)),))
+            self.conn.execute("INSERT INTO meta VALUES ('file_type', ?)", (file_type,))
+            self.conn.execute("INSERT INTO meta VALUES ('unreadable', ?)", (json.dumps(unreadable_files),))
+            self.conn.execute("INSERT INTO meta VALUES ('extractor', ?)", (EXTRACTOR_VERSION,))
+            self.conn.execute("INSERT INTO meta VALUES ('format', ?)", (self.FORMAT,))
+            self.conn.execute("INSERT INTO meta VALUES ('built_at', ?)", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+    
+    def meta(self, key, default=None):
+        """Read a metadata value stored with the index"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def tokens(self):
+        """Tokens the index was built for"""
+        return json.loads(self.meta('tokens', '[]'))
+    
+    def covers(self, patterns, file_type):
+        """Whether every non-empty pattern was indexed over the requested file types"""
+        if self.meta('extractor') != EXTRACTOR_VERSION or self.meta('format') != self.FORMAT:
+            return False
+        indexed_type = self.meta('file_type')
+        if indexed_type != file_type and indexed_type != "Both (.docx and .dcp.docx)":
+            return False
+        indexed = set(self.tokens())
+        return all(token in indexed for token in patterns if token)
+    
+    def query(self, patterns, file_filter):
+        """Answer a token selection from the index, yielding (metadata row, matched tokens) in walk order"""
+        matcher = TokenMatcher(patterns)
+        if not matcher.tokens:
+            return
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Create Excel metadata file
-            excel_buffer = BytesIO()
-            df = pd.DataFrame(metadata)
-            df.to_excel(excel_buffer, index=False, engine='openpyxl')
-            excel_buffer.seek(0)
-            
-            # Add Excel file to ZIP
-            zipf.writestr('scan_results.xlsx', excel_buffer.getvalue())
-            
-            # Add matched files
-            for file_path in matching_files:
-                if os.path.exists(file_path):
-                    arcname = os.path.join('matched_files', os.path.basename(file_path))
-                    zipf.write(file_path, arcname)
+        placeholders = ', '.join('?' * len(matcher.tokens))
+        rows = self.conn.execute(
+            f"SELECT f.ordinal, f.path, f.size, f.ctime, f.mtime, p.token, p.count, p.lines "
+            f"FROM postings p JOIN files f ON f.ordinal = p.ordinal "
+            f"WHERE p.token IN ({placeholders}) ORDER BY f.ordinal",
+            matcher.tokens
+        )
         
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
+        # Group postings per file, keeping the index's walk order
+        files = {}
+        for ordinal, full_path, size, ctime, mtime, token, count, lines in rows:
+            if ordinal not in files:
+                info = SimpleNamespace(st_size=size, st_ctime=ctime, st_mtime=mtime)
+                files[ordinal] = (full_path, info, {})
+            files[ordinal][2][token] = (count, *json.loads(lines))
         
-    except Exception as e:
-        st.error(f"Error creating ZIP: {str(e)}")
+        for full_path, info, hits in files.values():
+            if not file_filter(os.path.basename(full_path)):
+                continue
+            record = DocumentScanner.build_record(full_path, info, matcher, hits)
+            if record:
+                yield record, matcher.matched_tokens(hits)
+    
+    def stale_reason(self, folder_path, workers=DEFAULT_SCAN_OPTIONS['discovery_workers']):
+        """Why the indexed files no longer match the folder, or None while the index is current"""
+        # Listing the folder is far cheaper than extracting it; size and mtime catch
+        # edited, added and removed documents alike
+        indexed = {path: (size, mtime) for path, size, mtime in self.conn.execute("SELECT path, size, mtime FROM files")}
+        indexed.update((path, (size, mtime)) for path, size, mtime in json.loads(self.meta('unreadable', '[]')))
+        discovery = FileDiscovery(folder_path, make_file_filter(self.meta('file_type')), workers).start()
+        added = modified = 0
+        seen = 0
+        try:
+            while True:
+                batch = discovery.take()
+                if not batch:
+                    break
+                for _, full_path, info in batch:
+                    entry = indexed.get(full_path)
+                    if entry is None:
+                        added += 1
+                    else:
+                        seen += 1
+                        if entry != (info.st_size, info.st_mtime):
+                            modified += 1
+        finally:
+            discovery.close()
+        deleted = len(indexed) - seen
+        if added or modified or deleted:
+            return f"{added} added, {modified} modified, {deleted} deleted"
         return None
+    
+    def count_matrix(self, patterns, file_filter):
+        """Dense file x token count matrix for the given tokens, as a DataFrame"""
+        tokens = TokenMatcher(patterns).tokens
+        files = [
+            (ordinal, full_path)
+            for ordinal, full_path in self.conn.execute("SELECT ordinal, path FROM files ORDER BY ordinal")
+            if file_filter(os.path.basename(full_path))
+        ]
+        rows = {ordinal: i for i, (ordinal, _) in enumerate(files)}
+        columns = {token: j for j, token in enumerate(tokens)}
+        counts = np.zeros((len(files), len(tokens)), dtype=np.int64)
+        
+        if tokens:
+            placeholders = ', '.join('?' * len(tokens))
+            for token, ordinal, count in self.conn.execute(
+                f"SELECT token, ordinal, count FROM postings WHERE token IN ({placeholders})", tokens
+            ):
+                if ordinal in rows:
+                    counts[rows[ordinal], columns[token]] = count
+        
+        return pd.DataFrame(counts, index=pd.Index([p for _, p in files], name='File Path'), columns=tokens)
+    
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
 
-def format_file_size(size_bytes):
-    """Format file size in human readable format"""
-    if size_bytes == 0:
-        return "0 B"
-    size_names = ["B", "KB", "MB", "GB"]
-    i = 0
-    while size_bytes >= 1024 and i < len(size_names) - 1:
-        size_bytes /= 1024.0
-        i += 1
-    return f"{size_bytes:.1f} {size_names[i]}"
-
-def get_drives_windows():
-    """Get available drives on Windows"""
-    drives = []
-    for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
-        drive = f"{letter}:\\"
-        if os.path.exists(drive):
-            drives.append(drive)
-    return drives
-
-def get_recent_folders():
-    """Get recently accessed folders (simple heuristic)"""
-    recent = []
-    user_home = os.path.expanduser("~")
+class ResultStore:
+    """Metadata rows of a scan in a JSONL file, written as they arrive and read back lazily"""
     
-    # Common recent folder locations
-    potential_folders = [
-        os.path.join(user_home, "Documents"),
-        os.path.join(user_home, "Desktop"),
-        os.path.join(user_home, "Downloads"),
-        os.path.join(user_home, "OneDrive"),
-        os.path.join(user_home, "Google Drive"),
-        os.path.join(user_home, "Dropbox"),
-    ]
+    def __init__(self, path):
+        self.path = path
+        # Over-budget files are few, kept as (ordinal, row) for the Skipped sheet
+        self.skipped = []
+        self.count = 0
+        self.total_matches = 0
+        self.total_size = 0
+        self.unique_patterns = 0
+        self.pattern_files = {}
+        self._patterns = set()
+        self._file = None
+    
+    @classmethod
+    def create(cls, results_dir, name):
+        """Start an empty store for writing"""
+        os.makedirs(results_dir, exist_ok=True)
+        store = cls(os.path.join(results_dir, f"{name}.jsonl"))
+        store._file = open(store.path, 'w', encoding='utf-8')
+        return store
     
-    for folder in potential_folders:
-        if os.path.exists(folder):
-            # Check if it contains any .docx files
+    @classmethod
+    def reopen(cls, path, size, skipped=()):
+        """Reopen a partly written store for appending, dropping rows written past size"""
+        store = cls(path)
+        store.skipped = [list(item) for item in skipped]
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+        for _, record, *tokens in store._iter_rows():
+            store._tally(record, *tokens)
+        store._file = open(path, 'a', encoding='utf-8')
+        return store
+    
+    @staticmethod
+    def purge(results_dir, max_age):
+        """Delete stores left behind by sessions that ended without collecting them"""
+        cutoff = time.time() - max_age
+        for path in glob.glob(os.path.join(results_dir, "*.jsonl")):
             try:
-                docx_count = len(glob.glob(os.path.join(folder, "**/*.docx"), recursive=True))
-                if docx_count > 0:
-                    recent.append((folder, docx_count))
-            except:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
                 pass
     
-    return recent
-
-def smart_path_suggestions(current_input):
-    """Provide intelligent path suggestions based on current input"""
-    if not current_input:
-        return []
+    def _tally(self, record, tokens=()):
+        """Fold a row into the running totals"""
+        self.count += 1
+        self.total_matches += record.get('Token Match Count') or 0
+        self.total_size += record.get('Size (bytes)', 0)
+        if record.get('Matched Pattern(s)'):
+            self._patterns.add(record['Matched Pattern(s)'])
+            self.unique_patterns = len(self._patterns)
+        for token in tokens:
+            self.pattern_files[token] = self.pattern_files.get(token, 0) + 1
     
-    try:
-        # If it's a partial path, try to complete it
-        if os.path.sep in current_input:
-            parent = os.path.dirname(current_input)
-            if os.path.exists(parent):
-                basename = os.path.basename(current_input).lower()
-                items = []
-                
-                for item in os.listdir(parent):
-                    full_path = os.path.join(parent, item)
-                    if (os.path.isdir(full_path) and 
-                        item.lower().startswith(basename) and
-                        not item.startswith('.')):
-                        # Count docx files in this directory
-                        try:
-                            docx_count = len(glob.glob(os.path.join(full_path, "**/*.docx"), recursive=True))
-                            items.append((full_path, item, docx_count))
-                        except:
-                            items.append((full_path, item, 0))
-                
-                # Sort by docx count (descending) and name
-                items.sort(key=lambda x: (-x[2], x[1].lower()))
-                return items[:8]  # Limit to 8 suggestions
+    def add(self, ordinal, record, tokens=()):
+        """Append a metadata row for the file at a walk-order position, with the tokens it matched"""
+        self._file.write(json.dumps([ordinal, record, list(tokens)]) + '\n')
+        self._tally(record, tokens)
+    
+    def skip(self, ordinal, row):
+        """Record a file that was skipped rather than scanned"""
+        self.skipped.append([ordinal, row])
+    
+    def skipped_rows(self):
+        """Rows of the skipped files, in walk order"""
+        return [row for _, row in self.skipped]
+    
+    def flush(self):
+        """Flush pending rows to disk and return the store's size in bytes"""
+        self._file.flush()
+        return self._file.tell()
+    
+    def finalize(self, order=None):
+        """Stop writing and rewrite the rows in walk order, mapping ordinals through order when given"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._patterns = set()
+        self.skipped.sort(key=lambda item: order[item[0]] if order else item[0])
         
-        # If it's just a drive letter or root, show top-level directories
+        # Only (ordinal, offset) pairs are held in memory while sorting
+        offsets = []
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                ordinal = int(line[1:line.index(b',')])
+                offsets.append((order[ordinal] if order else ordinal, offset))
+                offset += len(line)
+        if all(a <= b for a, b in zip(offsets, offsets[1:])):
+            return
+        offsets.sort()
+        tmp_path = f"{self.path}.tmp"
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for _, offset in offsets:
+                src.seek(offset)
+                dst.write(src.readline())
+        os.replace(tmp_path, self.path)
+    
+    def close(self):
+        """Close the store without reordering, e.g. when a scan is cancelled"""
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def delete(self):
+        """Remove the store from disk"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+    
+    def _iter_rows(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        """Metadata rows in walk order, read from disk one at a time"""
+        for _, record, *_ in self._iter_rows():
+            yield record
+    
+    def paths(self):
+        """File paths of the matching files, in walk order"""
+        for record in self:
+            yield record['File Path']
+    
+    def page(self, start, stop):
+        """Rows start..stop as a list, for paging through the results table"""
+        return list(itertools.islice(self, start, stop))
+
+class ExportArtifacts:
+    """Export downloads built on demand and reused across reruns while their inputs are unchanged"""
+    
+    def __init__(self):
+        # Replaced artifact files are deleted; the session drops them all
+        # whenever its result store is replaced
+        self._artifacts = {}  # kind -> (fingerprint, file path, matched files fingerprint)
+    
+    @staticmethod
+    def purge(export_dir, max_age):
+        """Delete export files left behind by sessions that ended without clearing them"""
+        cutoff = time.time() - max_age
+        for path in glob.glob(os.path.join(export_dir, "*")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _discard(data):
+        if isinstance(data, str):
+            try:
+                os.remove(data)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def fingerprint(store, *parts):
+        """Fingerprint a result store and extra settings"""
+        digest = hashlib.sha1()
+        try:
+            info = os.stat(store.path)
+            digest.update(f"{store.path}|{info.st_size}|{info.st_mtime_ns}|{len(store.skipped)}".encode('utf-8'))
+        except OSError:
+            digest.update(store.path.encode('utf-8'))
+        for part in parts:
+            digest.update(f"|{part}".encode('utf-8'))
+        return digest.hexdigest()
+    
+    @staticmethod
+    def files_fingerprint(paths):
+        """Fingerprint the size and mtime of each path; one stat per file"""
+        digest = hashlib.sha1()
+        for full_path in paths:
+            try:
+                info = os.stat(full_path)
+                digest.update(f"|{full_path}|{info.st_size}|{info.st_mtime_ns}".encode('utf-8'))
+            except OSError:
+                digest.update(f"|{full_path}|missing".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get(self, kind, fingerprint):
+        """The stored artifact if it was built from the same fingerprint, else None"""
+        entry = self._artifacts.get(kind)
+        if not entry:
+            return None
+        if entry[0] != fingerprint:
+            # Built from results that have since changed, so it is never served again
+            self._discard(entry[1])
+            del self._artifacts[kind]
+            return None
+        if isinstance(entry[1], str) and not os.path.exists(entry[1]):
+            return None  # Purged from disk in the meantime
+        return entry[1]
+    
+    def put(self, kind, fingerprint, data, files_fingerprint=None):
+        if kind in self._artifacts and self._artifacts[kind][1] != data:
+            self._discard(self._artifacts[kind][1])
+        self._artifacts[kind] = (fingerprint, data, files_fingerprint)
+    
+    def files_changed(self, kind, paths):
+        """Whether the files an artifact was built from changed since, dropping it if so"""
+        entry = self._artifacts.get(kind)
+        if not entry or entry[2] is None or entry[2] == self.files_fingerprint(paths):
+            return False
+        self._discard(entry[1])
+        del self._artifacts[kind]
+        return True
+    
+    def clear(self):
+        for _, data, _ in self._artifacts.values():
+            self._discard(data)
+        self._artifacts.clear()
+
+def folder_key(folder_path):
+    """Stable file-name-safe key for a scanned folder"""
+    return hashlib.sha1(os.path.abspath(folder_path).encode('utf-8')).hexdigest()
+
+def file_sha1(full_path):
+    """SHA-1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(full_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FileDiscovery:
+    """Threaded os.scandir walk that streams matching files, keyed by walk order, while the scan runs"""
+    
+    def __init__(self, folder_path, file_filter, workers=8):
+        self.folder_path = folder_path
+        self.file_filter = file_filter
+        self.workers = max(1, int(workers))
+        self.finished = False
+        self.folders = {}  # mtime of every folder listed, taken before listing it
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._closed = False
+        self._executor = None
+    
+    def start(self):
+        """Start listing folders in the background"""
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="docxscan-walk")
+        self._submit((), self.folder_path)
+        return self
+    
+    def _submit(self, key, path):
+        with self._lock:
+            self._outstanding += 1
+        try:
+            self._executor.submit(self._list_folder, key, path)
+        except RuntimeError:
+            self._folder_done()  # Closed while the walk was still running
+    
+    def _folder_done(self):
+        with self._lock:
+            self._outstanding -= 1
+            last = self._outstanding == 0
+        if last:
+            self._queue.put(None)
+    
+    def _list_folder(self, key, path):
+        """List one folder, queueing its files and submitting its subfolders"""
+        files = []
+        subfolders = []
+        try:
+            if not self._closed:
+                self.folders[path] = os.stat(path).st_mtime_ns
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            # Like os.walk, do not descend into symlinked folders
+                            if not entry.is_symlink():
+                                subfolders.append(entry.path)
+                        elif self.file_filter(entry.name) and not entry.name.startswith('~'):
+                            try:
+                                info = entry.stat()
+                            except OSError:
+                                continue  # Broken link or a file that vanished
+                            files.append((key + (0, len(files)), entry.path, info))
+        except OSError:
+            pass  # Unreadable folders are skipped, as os.walk does
+        
+        # A folder's files sort before everything in its subfolders
+        for i, subfolder in enumerate(subfolders):
+            if not self._closed:
+                self._submit(key + (1, i), subfolder)
+        if files:
+            self._queue.put(files)
+        self._folder_done()
+    
+    def take(self, block=True):
+        """Return the files found since the last call as (walk key, path, stat) tuples, [] once all are taken"""
+        found = []
+        while not self.finished:
+            try:
+                files = self._queue.get(block=block and not found)
+            except queue.Empty:
+                break
+            if files is None:
+                self.finished = True
+                self._executor.shutdown(wait=False)
+            else:
+                found.extend(files)
+        return found
+    
+    def close(self):
+        """Stop listing folders, e.g. when the scan is cancelled"""
+        self._closed = True
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def walk_order(keys):
+        """Map each file's discovery position to its position in os.walk order"""
+        order = [0] * len(keys)
+        for rank, index in enumerate(sorted(range(len(keys)), key=keys.__getitem__)):
+            order[index] = rank
+        return order
+
+class DiscoverySnapshot:
+    """The files one walk of a folder found for a File Types selection, stale once a listed folder's mtime changes"""
+    
+    def __init__(self, folder_path, file_type):
+        self.folder_path = folder_path
+        self.file_type = file_type
+        self.files = []  # In os.walk order once complete
+        self.sizes = []
+        self.folders = {}
+        self.found = 0
+        self.complete = False
+        self.created_at = None
+        self.done = threading.Event()
+    
+    @classmethod
+    def from_walk(cls, folder_path, file_type, files, keys, sizes, folders):
+        """Snapshot the result of a finished scan walk, given in discovery order"""
+        snapshot = cls(folder_path, file_type)
+        snapshot._fill(sorted(zip(keys, files, (sizes[index] for index in range(len(files))))), folders)
+        return snapshot
+    
+    def build(self, workers=DEFAULT_SCAN_OPTIONS['discovery_workers']):
+        """Walk the folder, keeping a running count while it goes"""
+        found = []
+        try:
+            discovery = FileDiscovery(self.folder_path, make_file_filter(self.file_type), workers).start()
+            while True:
+                batch = discovery.take()
+                if not batch:
+                    break
+                found.extend((key, full_path, info.st_size) for key, full_path, info in batch)
+                self.found = len(found)
+            found.sort()
+            self._fill(found, discovery.folders)
+        finally:
+            self.complete = True
+            self.done.set()
+    
+    def _fill(self, walk, folders):
+        self.files = [full_path for _, full_path, _ in walk]
+        self.sizes = [size for _, _, size in walk]
+        self.folders = dict(folders)
+        self.found = len(self.files)
+        self.created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.complete = True
+        self.done.set()
+    
+    def root_changed(self):
+        """Cheap check of the top folder only, for the summary shown on every rerun"""
+        try:
+            return os.stat(self.folder_path).st_mtime_ns != self.folders.get(self.folder_path)
+        except OSError:
+            return True
+    
+    def is_current(self):
+        """Whether no listed folder has changed since the walk"""
+        if not self.complete or not self.folders:
+            return False
+        for path, mtime_ns in self.folders.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+    
+    def label(self):
+        """The file count for display, "1,000+" while the walk is still running"""
+        return f"{self.found:,}" if self.complete else f"{self.found:,}+"
+
+class DocumentBudgetExceeded(Exception):
+    """A document went over its size or time budget and is skipped rather than scanned"""
+
+class DocumentBudget:
+    """Per-file limits on the decompressed size of document.xml and on scanning time"""
+    
+    def __init__(self, max_bytes=0, timeout=0):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+    
+    @classmethod
+    def from_options(cls, options):
+        """Start the budget of one file from the scan options, or None without limits"""
+        if not options['max_xml_mb'] and not options['file_timeout']:
+            return None
+        return cls(int(options['max_xml_mb'] * 1024 * 1024), options['file_timeout'])
+    
+    def check_size(self, size):
+        if self.max_bytes and size > self.max_bytes:
+            raise DocumentBudgetExceeded(
+                f"document.xml is {format_file_size(size)}, over the {format_file_size(self.max_bytes)} limit")
+    
+    def check_time(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DocumentBudgetExceeded(f"scanning took longer than {self.timeout} s")
+    
+    def check_package(self, full_path):
+        """Check the size of a package's main part before python-docx loads all of it"""
+        try:
+            with zipfile.ZipFile(full_path) as zipf:
+                size = zipf.getinfo(DocumentScanner.main_document_part(zipf)).file_size
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return  # A damaged package fails in python-docx with its own error
+        self.check_size(size)
+    
+    def wrap(self, stream):
+        return BudgetedStream(stream, self)
+
+class BudgetedStream:
+    """Read-only stream that checks a DocumentBudget's deadline on every read"""
+    
+    def __init__(self, stream, budget):
+        self.stream = stream
+        self.budget = budget
+    
+    def read(self, size=-1):
+        self.budget.check_time()
+        return self.stream.read(size)
+    
+    # Seekable so zipfile, and with it python-docx, can open it
+    def seek(self, offset, whence=0):
+        return self.stream.seek(offset, whence)
+    
+    def tell(self):
+        return self.stream.tell()
+    
+    def seekable(self):
+        return self.stream.seekable()
+
+class DocumentScanner:
+    """Core document scanning functionality"""
+    
+    @staticmethod
+    def extract_full_text_lines(doc, stats=None, budget=None):
+        """Extract text from document"""
+        lines = []
+        try:
+            for para in doc.paragraphs:
+                if budget:
+                    budget.check_time()
+                if para.text.strip():
+                    lines.append(para.text)
+            for table in doc.tables:
+                above = {}
+                for tr in table._tbl.tr_lst:
+                    if budget:
+                        budget.check_time()
+                    above = DocumentScanner._collect_row_lines(tr, above, lines, stats)
+        except DocumentBudgetExceeded:
+            raise
+        except Exception as e:
+            lines.append(f"Error extracting text: {str(e)}")
+        return lines
+    
+    @staticmethod
+    def extract_xml_text_lines(source, stats=None, budget=None):
+        """Extract the same lines as extract_full_text_lines without python-docx"""
+        return list(DocumentScanner.iter_xml_text_lines(source, stats=stats, budget=budget))
+    
+    @staticmethod
+    def extract_document_lines(full_path, extractor='xml', data=None, stats=None, budget=None):
+        """Extract text lines with the chosen backend, falling back to python-docx"""
+        # data may already hold the decompressed document.xml
+        if extractor == 'xml':
+            try:
+                if data is not None:
+                    stream = BytesIO(data)
+                    return list(DocumentScanner._iter_body_lines(budget.wrap(stream) if budget else stream,
+                                                                 stats=stats))
+                return DocumentScanner.extract_xml_text_lines(full_path, stats, budget)
+            except DocumentBudgetExceeded:
+                raise
+            except Exception:
+                if stats is not None:
+                    stats.pop('duplicate_cells', None)
+                    stats.pop('duplicate_chars', None)
+                # python-docx reports its own errors for damaged files
+        if not budget:
+            return DocumentScanner.extract_full_text_lines(Document(full_path), stats)
+        budget.check_package(full_path)
+        with open(full_path, 'rb') as f:
+            doc = Document(budget.wrap(f))
+        return DocumentScanner.extract_full_text_lines(doc, stats, budget)
+    
+    @staticmethod
+    def iter_xml_text_lines(source, ordered=True, stats=None, budget=None):
+        """Stream paragraph and table-cell text straight from the main document part"""
+        with zipfile.ZipFile(source) as zipf:
+            with DocumentScanner.open_document_xml(zipf, budget) as xml_stream:
+                yield from DocumentScanner._iter_body_lines(budget.wrap(xml_stream) if budget else xml_stream,
+                                                            ordered, stats)
+    
+    @staticmethod
+    def open_document_xml(zipf, budget=None):
+        """Open the main document part, refusing it if it decompresses past the budget"""
+        name = DocumentScanner.main_document_part(zipf)
+        if budget:
+            budget.check_size(zipf.getinfo(name).file_size)
+        return zipf.open(name)
+    
+    @staticmethod
+    def read_document_xml(full_path, budget=None):
+        """Return the decompressed bytes of the main document part"""
+        with zipfile.ZipFile(full_path) as zipf:
+            with DocumentScanner.open_document_xml(zipf, budget) as xml_stream:
+                if not budget:
+                    return xml_stream.read()
+                chunks = []
+                while True:
+                    budget.check_time()
+                    chunk = xml_stream.read(1024 * 1024)
+                    if not chunk:
+                        return b''.join(chunks)
+                    chunks.append(chunk)
+    
+    @staticmethod
+    def prefilter_document(full_path, matcher, options, details=None, budget=None):
+        """Return (rejected, document.xml bytes) for a file about to be extracted"""
+        if not options['prefilter'] or not matcher.prefilter.enabled:
+            return False, None
+        try:
+            data = DocumentScanner.read_document_xml(full_path, budget)
+        except DocumentBudgetExceeded:
+            raise
+        except Exception:
+            return False, None  # Unreadable here; extraction reports the error
+        rejected = not matcher.prefilter.may_match(data)
+        if rejected and details is not None:
+            details['prefilter'] = 'rejected'
+        return rejected, data
+    
+    @staticmethod
+    def main_document_part(zipf):
+        """Resolve the main document part name from the package relationships"""
+        try:
+            rels = ElementTree.fromstring(zipf.read('_rels/.rels'))
+            for rel in rels:
+                if rel.get('Type', '').endswith(OFFICE_DOCUMENT_REL):
+                    return rel.get('Target').lstrip('/')
+        except KeyError:
+            pass
+        return 'word/document.xml'
+    
+    @staticmethod
+    def _iter_body_lines(xml_stream, ordered=True, stats=None):
+        """Yield body paragraphs, then table cells, mirroring doc.paragraphs and doc.tables"""
+        # With ordered=False cells are yielded as their row closes, so a consumer
+        # that stops early never parses the rest of the document
+        stack = []
+        body = None
+        table_lines = []
+        above = {}
+        
+        for event, elem in ElementTree.iterparse(xml_stream, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == W_BODY:
+                    body = elem
+                elif elem.tag == W_TBL and len(stack) > 1 and stack[-2] is body:
+                    above = {}
+                continue
+            
+            stack.pop()
+            if body is None or not stack:
+                continue
+            parent = stack[-1]
+            
+            # Rows of top-level tables are handled as soon as they close
+            if elem.tag == W_TR and parent.tag == W_TBL and len(stack) > 1 and stack[-2] is body:
+                above = DocumentScanner._collect_row_lines(elem, above, table_lines, stats)
+                parent.remove(elem)
+                if not ordered:
+                    yield from table_lines
+                    table_lines.clear()
+            elif parent is body:
+                if elem.tag == W_P:
+                    text = DocumentScanner._paragraph_text(elem)
+                    if text.strip():
+                        yield text
+                body.remove(elem)
+        
+        yield from table_lines
+    
+    @staticmethod
+    def _collect_row_lines(tr, above, table_lines, stats=None):
+        """Append the text of each w:tc in a row once, then its nested tables, and return the row's grid layout"""
+        # python-docx repeats a merged cell across its span; the copies are skipped and tallied in stats
+        grid_before = 0
+        row = {}
+        for child in tr:
+            if child.tag == W_TRPR:
+                node = child.find(W_GRID_BEFORE)
+                if node is not None:
+                    grid_before = int(node.get(W_VAL))
+        
+        offset = grid_before
+        for tc in tr:
+            if tc.tag != W_TC:
+                continue
+            span = 1
+            vmerge = None
+            tc_pr = tc.find(W_TCPR)
+            if tc_pr is not None:
+                node = tc_pr.find(W_GRID_SPAN)
+                if node is not None:
+                    span = int(node.get(W_VAL))
+                node = tc_pr.find(W_VMERGE)
+                if node is not None:
+                    vmerge = node.get(W_VAL, 'continue')
+            
+            text = '\n'.join(DocumentScanner._paragraph_text(p) for p in tc if p.tag == W_P)
+            if text.strip():
+                table_lines.append(text)
+            
+            # A vertically merged continuation stands for the cell it continues
+            if vmerge == 'continue' and offset in above:
+                row[offset] = above[offset]
+                copy, copies = above[offset]
+            else:
+                row[offset] = (text, span)
+                copy, copies = text, span - 1
+            if stats is not None and copies and copy.strip():
+                stats['duplicate_cells'] = stats.get('duplicate_cells', 0) + copies
+                stats['duplicate_chars'] = stats.get('duplicate_chars', 0) + len(copy) * copies
+            
+            for nested in tc:
+                if nested.tag == W_TBL:
+                    nested_above = {}
+                    for nested_tr in nested:
+                        if nested_tr.tag == W_TR:
+                            nested_above = DocumentScanner._collect_row_lines(nested_tr, nested_above,
+                                                                              table_lines, stats)
+            offset += span
+        return row
+    
+    @staticmethod
+    def _paragraph_text(p):
+        """Text of the runs and hyperlinks directly inside a w:p element"""
+        parts = []
+        for child in p:
+            if child.tag == W_R:
+                DocumentScanner._append_run_text(child, parts)
+            elif child.tag == W_HYPERLINK:
+                for run in child:
+                    if run.tag == W_R:
+                        DocumentScanner._append_run_text(run, parts)
+        return ''.join(parts)
+    
+    @staticmethod
+    def _append_run_text(run, parts):
+        """Translate run content the same way python-docx Run.text does"""
+        for child in run:
+            if child.tag == W_T:
+                if child.text:
+                    parts.append(child.text)
+            elif child.tag == W_BR:
+                if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                    parts.append('\n')
+            elif child.tag in W_RUN_TEXT:
+                parts.append(W_RUN_TEXT[child.tag])
+    
+    @staticmethod
+    def load_document_lines(full_path, info, matcher, options, cache=None, details=None, budget=None):
+        """Extract text lines, serving unchanged files from the extraction cache"""
+        version = f"{EXTRACTOR_VERSION}:{options['extractor']}"
+        if cache is not None and info is not None:
+            lines = cache.get(full_path, info.st_size, info.st_mtime_ns, version)
+            if details is not None:
+                details['cache'] = 'hit' if lines is not None else 'miss'
+            if lines is not None:
+                return lines
+        
+        rejected, data = DocumentScanner.prefilter_document(full_path, matcher, options, details, budget)
+        if rejected:
+            return []
+        lines = DocumentScanner.extract_document_lines(full_path, options['extractor'], data, details, budget)
+        if cache is not None and info is not None:
+            cache.put(full_path, info.st_size, info.st_mtime_ns, version, lines)
+        return lines
+    
+    @staticmethod
+    def find_first_match(full_path, info, matcher, options, cache=None, details=None, budget=None):
+        """Return the first token in a document, stopping extraction at the hit"""
+        lines = None
+        if cache is not None and info is not None:
+            lines = cache.get(full_path, info.st_size, info.st_mtime_ns, f"{EXTRACTOR_VERSION}:{options['extractor']}")
+            if details is not None:
+                details['cache'] = 'hit' if lines is not None else 'miss'
+        
+        # The prefilter inflates all of document.xml, while streaming stops at the first
+        # hit, so it only pays off ahead of python-docx, which loads everything anyway
+        if lines is None and options['extractor'] == 'xml':
+            try:
+                return matcher.first_match(DocumentScanner.iter_xml_text_lines(full_path, ordered=False,
+                                                                               budget=budget), budget)
+            except DocumentBudgetExceeded:
+                raise
+            except Exception:
+                pass  # Fall back to python-docx, which reports damaged files
+        if lines is None:
+            rejected, _ = DocumentScanner.prefilter_document(full_path, matcher, options, details, budget)
+            if rejected:
+                return None
+            lines = DocumentScanner.extract_document_lines(full_path, 'docx', budget=budget)
+        return matcher.first_match(lines, budget)
+    
+    @staticmethod
+    def process_file(full_path, matcher, options, cache=None, details=None):
+        """Extract and match one document, returning its metadata row or None"""
+        try:
+            info = os.stat(full_path)
+        except Exception:
+            info = None
+        
+        # Files-with-matches mode only needs to know that something matched
+        budget = DocumentBudget.from_options(options)
+        if options['first_hit']:
+            token = DocumentScanner.find_first_match(full_path, info, matcher, options, cache, details, budget)
+            if not token:
+                return None
+            if details is not None:
+                details['tokens'] = [token]
+            return DocumentScanner.make_record(full_path, info, [token], [], None)
+        
+        lines = DocumentScanner.load_document_lines(full_path, info, matcher, options, cache, details, budget)
+        hits = matcher.find_hits(lines, budget)
+        
+        # Fingerprint and hits for the folder manifest and token index. Hashing reads the
+        # whole file, so it is left to incremental scans, the only ones that compare it.
+        if details is not None and info is not None and (options['manifest_dir'] or options['build_index']):
+            details['manifest'] = {
+                'size': info.st_size,
+                'mtime_ns': info.st_mtime_ns,
+                'ctime': info.st_ctime,
+                'mtime': info.st_mtime,
+                'sha1': file_sha1(full_path) if options['incremental'] else None,
+                'hits': {token: [hit[0], hit[1][:3], *hit[2:]] for token, hit in hits.items()}
+            }
+        
+        if details is not None:
+            details['tokens'] = matcher.matched_tokens(hits)
+        return DocumentScanner.build_record(full_path, info, matcher, hits)
+    
+    @staticmethod
+    def build_record(full_path, info, matcher, hits):
+        """Build the metadata row for a file from its token hits, or None without a match"""
+        matched, matched_lines, token_count = matcher.summarize(hits)
+        if not matched:
+            return None
+        return DocumentScanner.make_record(full_path, info, matched, matched_lines, token_count)
+    
+    @staticmethod
+    def make_record(full_path, info, matched, matched_lines, token_count):
+        """Build the metadata row reported for a matching file"""
+        # Get file info
+        try:
+            file_size = info.st_size
+            creation_date = datetime.fromtimestamp(info.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
+            modified_date = datetime.fromtimestamp(info.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+        except Exception:
+            file_size = 0
+            creation_date = "Unknown"
+            modified_date = "Unknown"
+        
+        return {
+            'File Name': os.path.basename(full_path),
+            'File Path': full_path,
+            'Size (bytes)': file_size,
+            'Creation Date': creation_date,
+            'Modified Date': modified_date,
+            'Matched Pattern(s)': ', '.join(matched),
+            'Matched Line(s)': ' | '.join(matched_lines[:3]),  # Limit to 3 lines
+            'Token Match Count': token_count
+        }
+    
+    @staticmethod
+    def _iter_sequential(indexed_files, matcher, options, cache=None):
+        """Yield (index, record, error, details) for (index, path) pairs on the current thread"""
+        for index, full_path in indexed_files:
+            details = {}
+            try:
+                yield index, DocumentScanner.process_file(full_path, matcher, options, cache, details), None, details
+            except DocumentBudgetExceeded as e:
+                details['skipped'] = str(e)
+                yield index, None, None, details
+            except Exception as e:
+                yield index, None, str(e), details
+    
+    @staticmethod
+    def _iter_parallel(next_batch, patterns, options, sizes=None):
+        """Yield (index, record, error, details) from a process pool as file chunks complete"""
+        # A worker that dies breaks the whole pool; the pool is recreated and the
+        # files in flight are retried one at a time, so only the culprit is skipped
+        workers = max(1, int(options['workers']))
+        chunk_size = max(1, int(options['chunk_size']))
+        waiting = []  # Heap of (priority, index, path)
+        waiting_bytes = 0
+        exhausted = False
+        
+        def next_chunk():
+            """Pop the next task; a chunk closes early once it holds its share of the waiting bytes"""
+            nonlocal waiting_bytes
+            target = waiting_bytes / (workers * 2)
+            chunk = []
+            chunk_bytes = 0
+            while waiting and len(chunk) < chunk_size and (not sizes or not chunk or chunk_bytes < target):
+                _, index, full_path = heapq.heappop(waiting)
+                chunk.append((index, full_path))
+                if sizes:
+                    chunk_bytes += sizes[index]
+            waiting_bytes -= chunk_bytes
+            return chunk
+        
+        def start_pool():
+            return ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker,
+                                       initargs=(patterns, options))
+        
+        executor = start_pool()
+        pending = {}
+        suspects = deque()  # Files in flight when the pool broke, retried one at a time
+        retry = None  # Future of the suspect being retried
+        try:
+            while True:
+                # Take whatever discovery has found, waiting only when there is nothing to do
+                if not exhausted:
+                    block = not waiting and not pending and not suspects
+                    batch = next_batch(block)
+                    exhausted = block and not batch
+                    for index, full_path in batch:
+                        priority = -sizes[index] if sizes else index
+                        heapq.heappush(waiting, (priority, index, full_path))
+                        if sizes:
+                            waiting_bytes += sizes[index]
+                
+                # Keep a bounded number of chunks in flight, or a single suspect file
+                if suspects:
+                    if not pending:
+                        chunk = [suspects.popleft()]
+                        retry = executor.submit(_scan_worker, chunk)
+                        pending[retry] = chunk
+                else:
+                    while waiting and len(pending) < workers * 2:
+                        chunk = next_chunk()
+                        pending[executor.submit(_scan_worker, chunk)] = chunk
+                if not pending:
+                    if exhausted and not suspects:
+                        break
+                    continue
+                
+                done, _ = wait(pending, timeout=None if exhausted else 0.1, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        yield from future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if future is retry:
+                            # Retried alone and broke the pool again: this is the file
+                            yield chunk[0][0], None, None, {'skipped': "Worker process crashed on this file"}
+                        else:
+                            suspects.extend(chunk)
+                    except Exception as e:
+                        for index, _ in chunk:
+                            yield index, None, str(e), {}
+                if broken:
+                    for chunk in pending.values():
+                        suspects.extend(chunk)
+                    pending.clear()
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    executor = start_pool()
+        finally:
+            # A cancelled scan closes this generator; drop chunks that have not started
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    @staticmethod
+    def scan_documents(folder_path, patterns, file_filter, job, results, options=None, resume=None,
+                       discovered=None):
+        """Main document scanning logic, reporting progress and messages to a ScanJob"""
+        # resume is a ScanCheckpoint to pick up; discovered a DiscoverySnapshot reused while current
+        # Returns the result store, or None if the scan failed or was cancelled
+        options = {**DEFAULT_SCAN_OPTIONS, **(options or {})}
+        discovery = None
+        try:
+            # Log start
+            job.log("🔍 Starting document scan...")
+            job.log(f"📂 Folder: {os.path.basename(folder_path)}")
+            job.log(f"🎯 Patterns: {', '.join(patterns[:3])}{'...' if len(patterns) > 3 else ''}")
+            
+            # Files-with-matches mode records no hits, so it leaves the manifest and index alone
+            if options['first_hit']:
+                job.log("⚡ Files-with-matches mode: stopping at the first hit in each document")
+                options.update(manifest_dir=None, incremental=False, build_index=False)
+            
+            # Reuse stored hits for files unchanged since the last scan of this folder
+            manifest = ScanManifest.load(options['manifest_dir'], folder_path) if options['manifest_dir'] else None
+            matcher = TokenMatcher(patterns)
+            manifest_files = {}
+            reuse_manifest = False
+            if resume:
+                matcher = TokenMatcher(patterns, options.get('extra_tokens', ()))
+                manifest_files = dict(resume.entries)
+            elif options['incremental'] and manifest:
+                if manifest.covers(matcher.tokens):
+                    # Keep every recorded token up to date so the manifest stays complete
+                    options['extra_tokens'] = [t for t in manifest.tokens if t not in matcher.tokens]
+                    matcher = TokenMatcher(patterns, options['extra_tokens'])
+                    reuse_manifest = True
+                else:
+                    job.log("♻️ Token selection changed since the last scan, re-processing all files")
+            
+            workers = max(1, int(options['workers']))
+            reporter = ProgressReporter(0, job, options['progress_interval'], options['progress_every'])
+            done = set()
+            
+            # Files stream in from a threaded scandir walk while the scan runs, or come from
+            # the file list of an interrupted scan or of a still current discovery snapshot.
+            # Indexes are discovery positions; order maps them to os.walk order once the
+            # walk has finished.
+            all_files = []
+            sizes = {}
+            keys = []
+            order = None
+            if resume:
+                all_files = resume.files
+                order = resume.order
+                done = set(resume.done)
+                reporter.total = len(all_files)
+                reporter.done = reporter.started_done = len(done)
+                job.log(f"⏯️ Resuming from checkpoint saved {resume.saved_at}: "
+                        f"{len(done)} of {len(all_files)} files already done")
+            elif discovered is not None and discovered.is_current():
+                all_files = list(discovered.files)
+                sizes = dict(enumerate(discovered.sizes))
+                order = list(range(len(all_files)))
+                reporter.total = len(all_files)
+                job.log(f"📄 Found {len(all_files)} files to process (folder listing from {discovered.created_at})")
+            else:
+                discovery = FileDiscovery(folder_path, file_filter, options['discovery_workers']).start()
+                reporter.discovering = True
+            unchanged = 0
+            handed_over = False
+            
+            def reuse_entry(index, full_path, info):
+                """Report a file unchanged since the manifest from its stored hits; False if it must be scanned"""
+                nonlocal unchanged
+                entry = manifest.unchanged_entry(full_path, info)
+                if entry is None:
+                    return False
+                manifest_files[full_path] = entry
+                hits = {token: tuple(hit) for token, hit in entry['hits'].items()}
+                record = DocumentScanner.build_record(full_path, info, matcher, hits)
+                if record:
+                    results.add(index, record, matcher.matched_tokens(hits))
+                done.add(index)
+                unchanged += 1
+                reporter.done += 1
+                reporter.started_done += 1
+                return True
+            
+            def log_incremental():
+                deleted = len(set(manifest.files) - set(all_files))
+                job.log(f"♻️ Incremental: {unchanged} unchanged, {len(all_files) - unchanged} "
+                        f"added/modified, {deleted} deleted")
+            
+            def next_batch(block=True):
+                """Hand over the next (index, path) pairs to scan, [] once there are no more"""
+                nonlocal order, handed_over
+                if discovery is None:
+                    # A file list known up front is handed over at once
+                    if handed_over:
+                        return []
+                    handed_over = True
+                    batch = []
+                    for index, full_path in enumerate(all_files):
+                        if index in done:
+                            continue
+                        if reuse_manifest:
+                            try:
+                                if reuse_entry(index, full_path, os.stat(full_path)):
+                                    continue
+                            except OSError:
+                                pass
+                        batch.append((index, full_path))
+                    if reuse_manifest:
+                        log_incremental()
+                    if workers > 1 and options['largest_first']:
+                        for index, full_path in batch:
+                            if index not in sizes:
+                                try:
+                                    sizes[index] = os.stat(full_path).st_size
+                                except OSError:
+                                    sizes[index] = 0
+                    return batch
+                
+                while True:
+                    batch = []
+                    for key, full_path, info in discovery.take(block):
+                        index = len(all_files)
+                        all_files.append(full_path)
+                        keys.append(key)
+                        sizes[index] = info.st_size
+                        if not (reuse_manifest and reuse_entry(index, full_path, info)):
+                            batch.append((index, full_path))
+                    reporter.total = len(all_files)
+                    if discovery.finished and order is None:
+                        order = FileDiscovery.walk_order(keys)
+                        reporter.discovering = False
+                        job.log(f"📄 Found {len(all_files)} files to process")
+                        if reuse_manifest:
+                            log_incremental()
+                        # Later selections of this folder can reuse the listing instead of walking again
+                        job.discovered = DiscoverySnapshot.from_walk(folder_path, job.file_type, all_files, keys,
+                                                                     sizes, discovery.folders)
+                    if batch or not block or discovery.finished:
+                        return batch
+            
+            # Extract and match on the script thread or across a process pool
+            cache = None
+            if workers > 1:
+                job.log(f"⚙️ Parallel scan with {workers} workers")
+                # A big file dispatched last would keep one worker busy after the rest are idle
+                outcomes = DocumentScanner._iter_parallel(next_batch, patterns, options,
+                                                          sizes if options['largest_first'] else None)
+            else:
+                cache = open_extraction_cache(options)
+                outcomes = DocumentScanner._iter_sequential(itertools.chain.from_iterable(iter(next_batch, [])),
+                                                            matcher, options, cache)
+            
+            # Periodic checkpoints let an interrupted or cancelled scan resume where it stopped
+            checkpoint = (ScanCheckpoint(options['checkpoint_dir'], folder_path, job.owner)
+                          if options['checkpoint_dir'] else None)
+            last_checkpoint = time.monotonic()
+            
+            cache_hits = cache_misses = rejected = duplicate_cells = duplicate_chars = scanned = 0
+            skipped = len(results.skipped)
+            for index, record, error, details in outcomes:
+                filename = os.path.basename(all_files[index])
+                scanned += 1
+                
+                duplicate_cells += details.get('duplicate_cells', 0)
+                duplicate_chars += details.get('duplicate_chars', 0)
+                if details.get('prefilter') == 'rejected':
+                    rejected += 1
+                if details.get('cache') == 'hit':
+                    cache_hits += 1
+                elif details.get('cache') == 'miss':
+                    cache_misses += 1
+                if 'manifest' in details and not error:
+                    manifest_files[all_files[index]] = details['manifest']
+                
+                if error:
+                    reporter.log(f"❌ Error processing {filename}: {error}")
+                elif details.get('skipped'):
+                    if index not in sizes:
+                        try:
+                            sizes[index] = os.path.getsize(all_files[index])
+                        except OSError:
+                            sizes[index] = 0
+                    results.skip(index, {
+                        'File Name': filename,
+                        'File Path': all_files[index],
+                        'Size (bytes)': sizes[index],
+                        'Reason': details['skipped']
+                    })
+                    skipped += 1
+                    reporter.log(f"⏭️ Skipped {filename}: {details['skipped']}")
+                elif record:
+                    results.add(index, record, details.get('tokens', ()))
+                    reporter.log(f"✅ Match found: {filename}")
+                
+                reporter.advance(filename)
+                done.add(index)
+                if job.cancelled:
+                    break
+                # Checkpoints start once the walk has finished and the file list is complete
+                if (checkpoint and order is not None
+                        and time.monotonic() - last_checkpoint >= options['checkpoint_interval']):
+                    try:
+                        checkpoint.save(job, options, all_files, done, results, manifest_files, order)
+                    except OSError as e:
+                        job.log(f"⚠️ Could not write scan checkpoint: {str(e)}")
+                    last_checkpoint = time.monotonic()
+            outcomes.close()
+            reporter.flush()
+            
+            if cache:
+                cache.evict()
+                cache.close()
+            
+            if job.cancelled:
+                if checkpoint and order is None:
+                    # Listing folders is cheap next to extraction; finish the walk so the scan can resume
+                    job.log("⏹️ Finishing the folder walk so the scan can be resumed...")
+                    while next_batch():
+                        pass
+                if checkpoint:
+                    try:
+                        checkpoint.save(job, options, all_files, done, results, manifest_files, order)
+                        job.log(f"⏹️ Scan cancelled after {len(done)} of {len(all_files)} files, checkpoint saved")
+                    except OSError as e:
+                        job.log(f"⚠️ Scan cancelled, but the checkpoint could not be written: {str(e)}")
+                else:
+                    job.log(f"⏹️ Scan cancelled after {len(done)} of {len(all_files)} files")
+                results.close()
+                return None
+            
+            if not all_files:
+                job.log("❌ No files found to scan")
+                results.finalize()
+                return results
+            
+            if manifest:
+                try:
+                    manifest.save(matcher.tokens, manifest_files)
+                except OSError as e:
+                    job.log(f"⚠️ Could not write scan manifest: {str(e)}")
+            
+            if options['build_index'] and options['index_dir']:
+                try:
+                    walk_files = [all_files[i] for i in sorted(range(len(all_files)), key=order.__getitem__)]
+                    index = TokenIndex(options['index_dir'], folder_path)
+                    index.rebuild(matcher.tokens, [(p, manifest_files[p]) for p in walk_files if p in manifest_files],
+                                  options['file_type'], [p for p in walk_files if p not in manifest_files])
+                    index.close()
+                    job.index_current = True
+                    job.log(f"🗂️ Indexed {len(manifest_files)} files for {len(matcher.tokens)} tokens")
+                except (OSError, sqlite3.Error) as e:
+                    job.log(f"⚠️ Could not write token index: {str(e)}")
+            
+            # Put rows back into walk order so reports are reproducible
+            results.finalize(order)
+            if checkpoint:
+                checkpoint.discard()
+            
+            if cache_hits or cache_misses:
+                job.add_stats(cache_hits=cache_hits, cache_misses=cache_misses)
+                job.log(f"🗄️ Extraction cache: {cache_hits} hits, {cache_misses} misses")
+            if duplicate_cells:
+                job.log(f"🧩 Merged cells: skipped {duplicate_cells} repeated cells ({duplicate_chars:,} characters)")
+            if rejected:
+                job.add_stats(prefilter_rejected=rejected)
+                job.log(f"🔎 Prefilter skipped {rejected} of {scanned} files without a possible match")
+            if skipped:
+                job.add_stats(budget_skipped=skipped)
+                job.log(f"⏭️ {skipped} files over the size or time budget were skipped (see the Skipped sheet)")
+            
+            # Complete
+            job.update_progress(len(all_files), len(all_files), "Scan completed!")
+            
+            if results:
+                job.log(f"🎉 Scan complete! Found {len(results)} matching files")
+            else:
+                job.log("ℹ️ No matching files found")
+            
+            return results
+            
+        except Exception as e:
+            job.log(f"❌ Scan failed: {str(e)}")
+            job.set_state("failed", str(e))
+            results.close()
+            return None
+        finally:
+            if discovery:
+                discovery.close()
+
+def open_extraction_cache(options):
+    """Open the extraction cache configured in the scan options, or None"""
+    if not options.get('cache_dir'):
+        return None
+    try:
+        return ExtractionCache(options['cache_dir'], options['cache_max_mb'])
+    except (OSError, sqlite3.Error):
+        return None
+
+# Per-process state for pool workers, set up once by the initializer
+_scan_worker_state = {}
+
+def _init_scan_worker(patterns, options):
+    """Compile the matcher and open the cache once in each worker process"""
+    _scan_worker_state['matcher'] = TokenMatcher(patterns, options.get('extra_tokens', ()))
+    _scan_worker_state['options'] = options
+    _scan_worker_state['cache'] = open_extraction_cache(options)
+
+def _scan_worker(chunk):
+    """Process a chunk of (index, path) pairs in a worker process"""
+    matcher = _scan_worker_state['matcher']
+    options = _scan_worker_state['options']
+    cache = _scan_worker_state['cache']
+    return list(DocumentScanner._iter_sequential(chunk, matcher, options, cache))
+
+class ProgressReporter:
+    """Throttled progress and status updates for a running scan"""
+    
+    def __init__(self, total, job, interval=0.25, every=0, done=0):
+        self.total = total
+        self.job = job
+        self.interval = interval
+        self.every = every
+        self.done = done
+        self.started_done = done
+        self.discovering = False  # The total is still growing while files are discovered
+        self.started = time.monotonic()
+        self.last_flush = 0.0
+        self.last_flush_done = done
+        self.current = ""
+    
+    def log(self, message):
+        """Record a console message on the job"""
+        self.job.log(message)
+    
+    def advance(self, filename):
+        """Count one finished file and publish progress when an update is due"""
+        self.done += 1
+        self.current = filename
+        now = time.monotonic()
+        if now - self.last_flush >= self.interval or (self.every and self.done - self.last_flush_done >= self.every):
+            self.flush(now)
+    
+    def status_text(self, now):
+        """Status line with throughput and estimated time remaining"""
+        elapsed = now - self.started
+        processed = self.done - self.started_done
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        total = f"{self.total}+" if self.discovering else self.total
+        status = f"Processing {self.current[:20]}... • {self.done}/{total} files • {rate:.1f} files/s"
+        if rate > 0 and self.done < self.total and not self.discovering:
+            eta = int((self.total - self.done) / rate)
+            status += f" • ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        return status
+    
+    def flush(self, now=None):
+        """Publish progress and the status line to the job"""
+        now = time.monotonic() if now is None else now
+        self.last_flush = now
+        self.last_flush_done = self.done
+        self.job.update_progress(self.done, self.total, self.status_text(now))
+
+class ScanJob:
+    """A scan running on a background thread, polled by the session that started it"""
+    
+    def __init__(self, kind, folder_path, patterns, file_type, options, matrix=False, resume=None, discovered=None,
+                 owner=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.owner = owner  # Browser tab that started the job; only it may reattach to or collect it
+        self.kind = kind  # "scan" answers a token selection, "index" only rebuilds the token index
+        self.folder_path = folder_path
+        self.patterns = list(patterns)
+        self.file_type = file_type
+        self.options = options
+        self.matrix = matrix
+        self.resume = resume
+        self.discovered = discovered  # DiscoverySnapshot used by the scan, or the one its own walk produced
+        self.index_current = False  # Whether this job answered from or rebuilt the folder's token index
+        # The worker never touches st.session_state; the session polls it
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.progress = 0
+        self.status = "Queued"
+        self.messages = deque(maxlen=JOB_MESSAGE_LIMIT)
+        self.logged = 0  # Messages logged so far, including ones dropped from the buffer
+        self.stats = {'cache_hits': 0, 'cache_misses': 0, 'prefilter_rejected': 0, 'budget_skipped': 0}
+        self.results = None
+        self.token_matrix = None
+        self.error = None
+        self.thread = None
+    
+    def log(self, message, level=None):
+        """Record a timestamped console message and write it to the log file"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        with self.lock:
+            self.messages.append(f"[{timestamp}] {message}")
+            self.logged += 1
+        logger.log(message_level(message) if level is None else level, f"[{self.kind} {self.id}] {message}")
+    
+    def update_progress(self, done, total, status):
+        """Record files done out of total and the status line"""
+        with self.lock:
+            self.done = done
+            self.total = total
+            self.progress = int((done / total) * 100) if total else 100
+            self.status = status
+    
+    def add_stats(self, **counts):
+        """Add to the job's cache and prefilter counters"""
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+    
+    def set_state(self, state, error=None):
+        """Move the job to a new state"""
+        with self.lock:
+            self.state = state
+            self.error = error
+    
+    def finish(self, results, token_matrix=None):
+        """Store the results and mark the job completed"""
+        with self.lock:
+            self.results = results
+            self.token_matrix = token_matrix
+            self.state = "completed"
+    
+    def cancel(self):
+        """Ask the scan to stop after the file it is processing"""
+        if not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.log("⏹️ Cancelling scan...")
+    
+    @property
+    def cancelled(self):
+        """Whether cancellation has been requested"""
+        return self.cancel_event.is_set()
+    
+    @property
+    def finished(self):
+        """Whether the job has stopped running"""
+        return self.state in ("completed", "failed", "cancelled")
+    
+    def snapshot(self, cursor=0):
+        """Consistent copy of the job's progress and the messages logged since cursor"""
+        with self.lock:
+            start = max(0, cursor - (self.logged - len(self.messages)))
+            return {
+                'state': self.state,
+                'done': self.done,
+                'total': self.total,
+                'progress': self.progress,
+                'status': self.status,
+                'messages': list(itertools.islice(self.messages, start, None)),
+                'cursor': self.logged,
+                'stats': dict(self.stats),
+                'error': self.error
+            }
+
+class ScanJobRegistry:
+    """Process-wide table of background scan jobs by ID"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+    
+    def submit(self, job):
+        """Register a job and start its worker thread"""
+        with self.lock:
+            self.jobs[job.id] = job
+        job.thread = threading.Thread(target=run_scan_job, args=(job,), name=f"docxscan-{job.id}", daemon=True)
+        job.thread.start()
+        return job
+    
+    def get(self, job_id, owner=None):
+        """Look up one of the owner's jobs, or None if unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+    
+    def discard(self, job_id, owner=None):
+        """Forget one of the owner's jobs once its results have been collected"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.owner == owner:
+                del self.jobs[job_id]
+    
+    def active_for(self, folder_path, owner=None):
+        """The owner's job still running over the folder, e.g. one started before the page reloaded"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.folder_path == folder_path and job.owner == owner and not job.finished:
+                    return job
+        return None
+
+@st.cache_resource
+def get_scan_jobs():
+    """The scan job registry, created once per server process"""
+    return ScanJobRegistry()
+
+class StaleFileSweeper:
+    """Throttled purge of result stores and export files left behind by sessions that ended"""
+    
+    def __init__(self, interval=SWEEP_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_run = None
+    
+    def run(self):
+        """Purge now unless another session did within the interval"""
+        with self.lock:
+            now = time.monotonic()
+            if self.last_run is not None and now - self.last_run < self.interval:
+                return
+            self.last_run = now
+        ResultStore.purge(DEFAULT_RESULTS_DIR, RESULTS_MAX_AGE)
+        ExportArtifacts.purge(DEFAULT_EXPORTS_DIR, EXPORTS_MAX_AGE)
+
+@st.cache_resource
+def get_stale_file_sweeper():
+    """The sweeper that throttles purges across sessions"""
+    return StaleFileSweeper()
+
+class FolderWatcher:
+    """Polls a folder and keeps its extraction cache, scan manifest and token index warm"""
+    
+    def __init__(self, folder_path, options, interval=WATCH_INTERVAL, debounce=WATCH_DEBOUNCE,
+                 queue_limit=WATCH_QUEUE_LIMIT):
+        self.folder_path = folder_path
+        # Extract every changed file in full so any later token selection hits the cache
+        self.options = {**DEFAULT_SCAN_OPTIONS, **options, 'prefilter': False, 'first_hit': False}
+        self.interval = interval
+        self.debounce = debounce
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.messages = deque(maxlen=50)
+        self.known = None  # path -> (size, mtime_ns) as last processed
+        self.pending = {}  # path -> ((size, mtime_ns), first seen), oldest first
+        self.watched = 0
+        self.processed = 0
+        self.dropped = 0
+        self.last_poll = None
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="docxscan-watch", daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+    
+    def log(self, message):
+        with self.lock:
+            self.messages.append(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+        logger.log(message_level(message), f"[watch {self.folder_path}] {message}")
+    
+    def status_text(self):
+        """One-line summary for the folder panel"""
+        status = f"👁️ Watching {self.watched} files • {self.processed} warmed • {len(self.pending)} waiting"
+        if self.dropped:
+            status += f" • {self.dropped} left to the next scan"
+        if self.last_poll:
+            status += f" • polled {self.last_poll}"
+        return status
+    
+    def _run(self):
+        self.log(f"👁️ Watching {self.folder_path}")
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.log(f"❌ Watch poll failed: {str(e)}")
+            self.stop_event.wait(self.interval)
+        self.log("⏹️ Stopped watching")
+    
+    def poll(self):
+        """List the folder once and process the changes that have settled"""
+        discovery = FileDiscovery(self.folder_path, make_file_filter("Both (.docx and .dcp.docx)"),
+                                  self.options['discovery_workers']).start()
+        found = []
+        while not self.stop_event.is_set():
+            batch = discovery.take()
+            if not batch:
+                break
+            found.extend(batch)
+        discovery.close()
+        if self.stop_event.is_set():
+            return
+        found.sort(key=lambda item: item[0])
+        current = {full_path: info for _, full_path, info in found}
+        now = time.monotonic()
+        manifest = ScanManifest.load(self.options['manifest_dir'], self.folder_path) if self.options['manifest_dir'] else None
+        
+        if self.known is None:
+            # Files the manifest already describes are up to date; without one, start from now
+            self.known = {}
+            for full_path, info in current.items():
+                if not manifest or not manifest.files or manifest.unchanged_entry(full_path, info) is not None:
+                    self.known[full_path] = (info.st_size, info.st_mtime_ns)
+        
+        for full_path, info in current.items():
+            signature = (info.st_size, info.st_mtime_ns)
+            queued = self.pending.get(full_path)
+            if self.known.get(full_path) == signature:
+                self.pending.pop(full_path, None)
+            elif queued is None or queued[0] != signature:
+                # Still being written; restart its debounce
+                self.pending.pop(full_path, None)
+                self.pending[full_path] = (signature, now)
+        deleted = [full_path for full_path in self.known if full_path not in current]
+        for full_path in deleted:
+            del self.known[full_path]
+        for full_path in [p for p in self.pending if p not in current]:
+            del self.pending[full_path]
+        
+        while len(self.pending) > self.queue_limit:
+            full_path = next(iter(self.pending))
+            self.known[full_path] = self.pending.pop(full_path)[0]
+            self.dropped += 1
+        
+        self.watched = len(current)
+        self.last_poll = datetime.now().strftime('%H:%M:%S')
+        ready = [full_path for full_path, (_, seen) in self.pending.items() if now - seen >= self.debounce]
+        if ready or deleted:
+            self._apply(ready, deleted, [full_path for _, full_path, _ in found], manifest)
+    
+    def _apply(self, ready, deleted, walk_files, manifest):
+        """Extract settled files into the cache and fold them into the manifest and index"""
+        matcher = TokenMatcher(manifest.tokens if manifest else [])
+        cache = open_extraction_cache(self.options)
+        entries = {}
+        warmed = 0
+        try:
+            for index, _, error, details in DocumentScanner._iter_sequential(enumerate(ready), matcher,
+                                                                             self.options, cache):
+                full_path = ready[index]
+                self.known[full_path] = self.pending.pop(full_path)[0]
+                filename = os.path.basename(full_path)
+                if error:
+                    self.log(f"❌ Error processing {filename}: {error}")
+                elif details.get('skipped'):
+                    self.log(f"⏭️ Skipped {filename}: {details['skipped']}")
+                else:
+                    warmed += 1
+                    if 'manifest' in details:
+                        entries[full_path] = details['manifest']
+                if self.stop_event.is_set():
+                    break
+        finally:
+            if cache:
+                cache.evict()
+                cache.close()
+        
+        self.processed += warmed
+        if warmed:
+            self.log(f"🔥 Warmed {warmed} changed files")
+        
+        # Only a manifest from an earlier scan is kept up to date; its tokens decide the hits
+        if manifest and manifest.files and (entries or deleted):
+            files = {**manifest.files, **entries}
+            for full_path in deleted:
+                files.pop(full_path, None)
+            manifest.save(manifest.tokens, files)
+            self._refresh_index(manifest, walk_files)
+    
+    def _refresh_index(self, manifest, walk_files):
+        """Rebuild the folder's token index from the manifest when it was built for the same tokens"""
+        if not self.options['index_dir'] or not TokenIndex.exists(self.options['index_dir'], self.folder_path):
+            return
+        index = TokenIndex(self.options['index_dir'], self.folder_path)
+        try:
+            file_type = index.meta('file_type')
+            if set(index.tokens()) == set(manifest.tokens) and index.covers(manifest.tokens, file_type):
+                file_filter = make_file_filter(file_type)
+                walk_files = [p for p in walk_files if file_filter(os.path.basename(p))]
+                index.rebuild(manifest.tokens, [(p, manifest.files[p]) for p in walk_files if p in manifest.files],
+                              file_type, [p for p in walk_files if p not in manifest.files])
+                self.log("🗂️ Token index updated")
+        finally:
+            index.close()
+
+class FolderWatchers:
+    """The running folder watchers, at most one per folder"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers = {}
+    
+    def start(self, folder_path, options):
+        with self._lock:
+            watcher = self._watchers.get(folder_path)
+            if watcher is None or not watcher.running:
+                watcher = FolderWatcher(folder_path, options).start()
+                self._watchers[folder_path] = watcher
+            return watcher
+    
+    def get(self, folder_path):
+        with self._lock:
+            watcher = self._watchers.get(folder_path)
+            return watcher if watcher is not None and watcher.running else None
+    
+    def stop(self, folder_path):
+        with self._lock:
+            watcher = self._watchers.pop(folder_path, None)
+        if watcher:
+            watcher.stop()
+
+@st.cache_resource
+def get_folder_watchers():
+    """Folder watchers started from any session"""
+    return FolderWatchers()
+
+def run_scan_job(job):
+    """Worker thread body: answer the job from the token index or scan the folder"""
+    job.set_state("running")
+    try:
+        options = {**DEFAULT_SCAN_OPTIONS, **job.options}
+        file_filter = make_file_filter(job.file_type)
+        
+        # Answer from the folder's token index when it covers the selection
+        index = None
+        if (job.kind == "scan" and options['use_index'] and options['index_dir']
+                and TokenIndex.exists(options['index_dir'], job.folder_path)):
+            index = TokenIndex(options['index_dir'], job.folder_path)
+            if not index.covers(job.patterns, job.file_type):
+                index.close()
+                index = None
+                job.log("🗂️ Token index does not cover this selection, scanning documents")
+            else:
+                # Edited documents must not be answered with the hits they had when indexed
+                stale = index.stale_reason(job.folder_path, options['discovery_workers'])
+                if stale:
+                    index.close()
+                    index = None
+                    job.log(f"🗂️ Token index is out of date ({stale}), scanning documents")
+        
+        # Rows go straight to disk; a resumed scan appends to the store it was writing
+        if job.resume:
+            results = ResultStore.reopen(job.resume.results_path, job.resume.results_size,
+                                         job.resume.results_skipped)
+        else:
+            results = ResultStore.create(DEFAULT_RESULTS_DIR, job.id)
+        
+        if index:
+            started = time.perf_counter()
+            for ordinal, (record, tokens) in enumerate(index.query(job.patterns, file_filter)):
+                results.add(ordinal, record, tokens)
+            results.finalize()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            job.log(f"🗂️ Answered from token index built {index.meta('built_at')} in {elapsed_ms:.1f} ms")
+            index.close()
+            job.index_current = True
+            job.update_progress(len(results), len(results), "Answered from token index")
+        elif DocumentScanner.scan_documents(job.folder_path, job.patterns, file_filter, job, results,
+                                            options, job.resume, job.discovered) is None:
+            # Keep the partial rows while a checkpoint can still resume into them
+            if not options['checkpoint_dir']:
+                results.delete()
+            if job.cancelled:
+                job.set_state("cancelled")
+            return
+        
+        # Pivot the index into a file x token count matrix, unless it predates this scan,
+        # e.g. after a files-with-matches scan, which leaves the index alone
+        token_matrix = None
+        if job.matrix and not job.index_current:
+            job.log("🧮 Token matrix skipped: this scan did not rebuild the token index")
+        elif job.matrix and TokenIndex.exists(options['index_dir'], job.folder_path):
+            index = TokenIndex(options['index_dir'], job.folder_path)
+            if index.covers(job.patterns, job.file_type):
+                token_matrix = index.count_matrix(job.patterns, file_filter)
+                job.log(f"🧮 Token matrix: {token_matrix.shape[0]} files × {token_matrix.shape[1]} tokens")
+            index.close()
+        
+        if job.kind != "scan":
+            results.delete()
+        job.finish(results, token_matrix)
+    except Exception as e:
+        job.log(f"❌ Scan job failed: {str(e)}")
+        job.set_state("failed", str(e))
+
+def collect_scan_job(job):
+    """Move a finished job's results and counters into the session"""
+    snapshot = job.snapshot()
+    st.session_state.cache_stats['hits'] += snapshot['stats']['cache_hits']
+    st.session_state.cache_stats['misses'] += snapshot['stats']['cache_misses']
+    st.session_state.prefilter_rejected += snapshot['stats']['prefilter_rejected']
+    st.session_state.budget_skipped += snapshot['stats']['budget_skipped']
+    if job.discovered is not None and job.discovered.complete:
+        get_discovery_snapshots().put(job.discovered)
+    
+    if job.kind == "scan" and snapshot['state'] == "completed":
+        replace_result_store(job.results)
+        st.session_state.token_matrix = job.token_matrix
+        if job.results:
+            st.session_state.scan_notice = ("success", f"🎉 Scan completed! Found {len(job.results)} matching files")
+        else:
+            st.session_state.scan_notice = ("info", "ℹ️ Scan completed but no matching files were found")
+    elif snapshot['state'] == "cancelled":
+        st.session_state.scan_notice = ("warning", "⏹️ Scan cancelled. Use Resume to continue from the checkpoint.")
+    elif snapshot['state'] == "failed":
+        st.session_state.scan_notice = ("error", f"❌ Scan failed: {snapshot['error']}")
+    
+    st.session_state.scan_running = False
+    st.session_state.scan_job_id = None
+    get_scan_jobs().discard(job.id, st.session_state.owner)
+
+def replace_result_store(store):
+    """Point the session at a new result store, deleting the one it replaces"""
+    if st.session_state.result_store is not None:
+        st.session_state.result_store.delete()
+    st.session_state.result_store = store
+    st.session_state.export_artifacts.clear()
+
+def submit_scan_job(job):
+    """Start a job in the background and attach it to this session"""
+    get_scan_jobs().submit(job)
+    st.session_state.scan_job_id = job.id
+    st.session_state.scan_job_cursor = 0
+    st.session_state.scan_running = True
+    log_message(f"🧵 Started background {job.kind} job {job.id}")
+
+@st.fragment(run_every=1.0)
+def render_scan_job():
+    """Poll the session's background job, streaming its progress and console output"""
+    job = get_scan_jobs().get(st.session_state.scan_job_id, st.session_state.owner)
+    if job is None:
+        # The server restarted or the job was collected elsewhere
+        st.session_state.scan_running = False
+        st.session_state.scan_job_id = None
+        return
+    
+    snapshot = job.snapshot(st.session_state.scan_job_cursor)
+    st.session_state.scan_job_cursor = snapshot['cursor']
+    for message in snapshot['messages']:
+        st.session_state.console.add(message)
+    st.session_state.scan_progress = snapshot['progress']
+    st.session_state.scan_status = snapshot['status']
+    
+    st.progress(snapshot['progress'] / 100, text=f"Job {job.id} • {snapshot['status']}")
+    st.session_state.console.render(st.empty(), 5)
+    if st.button("⏹️ Cancel Scan", disabled=job.cancelled, key=f"cancel_scan_{job.id}"):
+        job.cancel()
+    
+    if job.finished:
+        collect_scan_job(job)
+        st.rerun()
+
+def log_message(message, level=None):
+    """Add message to console log and the log file"""
+    level = message_level(message) if level is None else level
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    st.session_state.console.add(f"[{timestamp}] {message}", level)
+    logger.log(level, message)
+
+def clear_console():
+    """Clear console messages"""
+    st.session_state.console.clear("[READY] Console cleared")
+
+def create_template():
+    """Create token template JSON"""
+    template = {
+        "<<FileService.": "Fileservice",
+        "</ff>": "Page Break",
+        "</pp>": "Hard Return",
+        "<backspace>": "Backspace",
+        "<<STNDRDTH": "STNDRD Add \"TH\"",
+        "<c>": "Center",
+        "<u>": "Underline",
+        "<i>": "Italic",
+        "<pcase>": "pcase",
+        "<lcase>": "lcase",
+        "<ucase>": "ucase",
+        "<bold>": "Bold",
+        "<nobullet>": "No Bullet",
+        "<fontsize": "Font Size",
+        "<s1>": "s1",
+        "<s2>": "s2",
+        "[[MCOMPUTEINTO(<<": "MCOMPUTE INTO",
+        "[[SCOMPUTEINTO(": "SCOMPUTE INTO",
+        "[[ABORTIIF": "Abortif",
+        "PROMTINTO(": "PROMTINTO",
+        "PROMTINTOIIF(": "PROMTINTOIIF",
+        "PROMTINTOLIST(": "PROMTINTOLIST",
+        "PROMTINTOIIFLIST(": "PROMTINTOIIFLIST",
+        "PROMTFORM(": "PROMTFORM",
+        "<<Checklist.": "CHECKLIST",
+        "TABLE(": "TABLE",
+        "<<jfig": "JFIG",
+        "jfig": "JFIG_General",
+        "{ATTY": "ESIGN",
+        "<<Special.": "SPECIAL",
+        "+91|<<Special.ToDay": "+91 special day",
+        "-91|<<Special.ToDay": "-91 special day",
+        "+2|<<Special.ToDay": "+2 special day",
+        "-2|<<Special.ToDay": "-2 special day",
+        "<<Tracker.MortDate>>~MMMM dd": "MMMM dd,yyyy",
+        "<<Tracker.MortDate>>~MM-dd-yyyy": "MM-dd-yyyy",
+        "<<Tracker.MortDate>>~ddd": "ddd,MMM dd-yyyy",
+        "<<Tracker.OriginalPrincipal>>~##": "##,###,###.00",
+        "CU$TOMMMMMMPLACEHOLDER": "Custom(Enter Below)"
+    }
+    
+    return json.dumps(template, indent=2)
+
+def write_excel_sheets(workbook, title, header, rows, max_rows=EXCEL_MAX_ROWS):
+    """Stream rows into write-only sheets, continuing on "title (2)" and so on when one is full"""
+    sheet = None
+    sheet_rows = max_rows
+    number = 0
+    for row in rows:
+        if sheet_rows >= max_rows:
+            number += 1
+            sheet = workbook.create_sheet(title if number == 1 else f"{title} ({number})")
+            sheet.append(header)
+            sheet_rows = 1
+        sheet.append(row)
+        sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet(title).append(header)
+
+class ReportSummary:
+    """Aggregates folded in while the report's rows stream past, for its Summary sheet"""
+    
+    def __init__(self):
+        self.files = 0
+        self.matches = 0
+        self.total_size = 0
+        self.largest = None
+        self.oldest = None
+        self.newest = None
+    
+    def add(self, record):
+        self.files += 1
+        self.matches += record.get('Token Match Count') or 0
+        size = record.get('Size (bytes)') or 0
+        self.total_size += size
+        if self.largest is None or size > self.largest[0]:
+            self.largest = (size, record.get('File Path'))
+        modified = record.get('Modified Date')
+        if modified and modified != "Unknown":
+            self.oldest = modified if self.oldest is None else min(self.oldest, modified)
+            self.newest = modified if self.newest is None else max(self.newest, modified)
+    
+    def write(self, workbook, skipped_count, pattern_files=None):
+        sheet = workbook.create_sheet('Summary')
+        sheet.append(['Metric', 'Value'])
+        sheet.append(['Files matched', self.files])
+        sheet.append(['Total matches', self.matches])
+        sheet.append(['Total size (bytes)', self.total_size])
+        sheet.append(['Average size (bytes)', round(self.total_size / self.files) if self.files else 0])
+        sheet.append(['Largest file', self.largest[1] if self.largest else None])
+        sheet.append(['Oldest modified', self.oldest])
+        sheet.append(['Newest modified', self.newest])
+        sheet.append(['Files skipped', skipped_count])
+        sheet.append(['Generated', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+        if pattern_files:
+            sheet.append([])
+            sheet.append(['Pattern', 'Files'])
+            for pattern, count in sorted(pattern_files.items(), key=lambda item: (-item[1], item[0])):
+                sheet.append([pattern, count])
+
+def create_excel_report(metadata, token_matrix=None, skipped=None, output=None, max_rows=EXCEL_MAX_ROWS,
+                        pattern_files=None):
+    """Stream metadata rows into a write-only Excel workbook with Summary, Token Matrix and Skipped sheets"""
+    # output is a path or binary file; without one the workbook is returned as bytes
+    workbook = Workbook(write_only=True)
+    summary = ReportSummary()
+    rows = iter(metadata)
+    first = next(rows, None)
+    columns = list(first.keys()) if first else []
+    
+    def result_rows():
+        for record in itertools.chain([first] if first else [], rows):
+            summary.add(record)
+            yield [record.get(column) for column in columns]
+    
+    write_excel_sheets(workbook, 'Results', columns, result_rows(), max_rows)
+    summary.write(workbook, len(skipped or ()), pattern_files)
+    if token_matrix is not None:
+        write_excel_sheets(workbook, 'Token Matrix', [token_matrix.index.name, *token_matrix.columns],
+                           ([index, *values] for index, *values in token_matrix.itertuples()), max_rows)
+    if skipped:
+        skipped_columns = list(skipped[0].keys())
+        write_excel_sheets(workbook, 'Skipped', skipped_columns,
+                           ([row.get(column) for column in skipped_columns] for row in skipped), max_rows)
+    
+    if output is not None:
+        workbook.save(output)
+        return None
+    excel_buffer = BytesIO()
+    workbook.save(excel_buffer)
+    return excel_buffer.getvalue()
+
+REPORT_DATE_COLUMNS = ('Creation Date', 'Modified Date')
+
+def typed_export_rows(metadata):
+    """Metadata rows with the report's formatted date strings parsed back into datetimes"""
+    for record in metadata:
+        row = dict(record)
+        for column in REPORT_DATE_COLUMNS:
+            if column in row:
+                try:
+                    row[column] = datetime.strptime(row[column], '%Y-%m-%d %H:%M:%S')
+                except (TypeError, ValueError):
+                    row[column] = None  # "Unknown" when the file could not be stat'ed
+        yield row
+
+def write_csv_export(metadata, output):
+    """Write rows as gzip-compressed CSV with ISO 8601 timestamps"""
+    with gzip.GzipFile(fileobj=output, mode='wb') as gz, TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+        writer = None
+        for row in typed_export_rows(metadata):
+            if writer is None:
+                writer = csv.DictWriter(text, fieldnames=list(row.keys()), extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow({key: value.isoformat() if isinstance(value, datetime) else value
+                             for key, value in row.items()})
+
+def write_jsonl_export(metadata, output):
+    """Write rows as JSON Lines with ISO 8601 timestamps"""
+    for row in typed_export_rows(metadata):
+        output.write((json.dumps(row, default=lambda value: value.isoformat()) + '\n').encode('utf-8'))
+
+def write_parquet_export(metadata, output):
+    """Write rows as Parquet, one row group per PARQUET_BATCH_ROWS rows, with timestamp columns"""
+    column_types = {'Size (bytes)': pa.int64(), 'Token Match Count': pa.int64(),
+                    **{column: pa.timestamp('s') for column in REPORT_DATE_COLUMNS}}
+    rows = typed_export_rows(metadata)
+    writer = None
+    try:
+        while True:
+            batch = list(itertools.islice(rows, PARQUET_BATCH_ROWS))
+            if not batch:
+                break
+            if writer is None:
+                schema = pa.schema([(column, column_types.get(column, pa.string())) for column in batch[0]])
+                writer = pq.ParquetWriter(output, schema)
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+# Data exports for analytics jobs: key -> (label, file suffix, mime type, writer)
+DATA_EXPORT_FORMATS = {
+    'csv': ("CSV (gzip)", '.csv.gz', "application/gzip", write_csv_export),
+    'jsonl': ("JSONL", '.jsonl', "application/x-ndjson", write_jsonl_export),
+}
+if pq is not None:
+    DATA_EXPORT_FORMATS = {
+        'parquet': ("Parquet", '.parquet', "application/vnd.apache.parquet", write_parquet_export),
+        **DATA_EXPORT_FORMATS
+    }
+
+def create_data_export(kind, metadata, zip_name="matched_files", export_dir=DEFAULT_EXPORTS_DIR):
+    """Write the results in one of the DATA_EXPORT_FORMATS to a file in export_dir and return its path"""
+    label, suffix, _, write = DATA_EXPORT_FORMATS[kind]
+    try:
+        return write_export_file(export_dir, zip_name, suffix, lambda f: write(metadata, f))
+    except Exception as e:
+        st.error(f"Error creating {label} export: {str(e)}")
+        return None
+
+def unique_arcname(name, used):
+    """Archive name for a file, numbered like "name (2).docx" when the name is already taken"""
+    arcname = name
+    if name.lower().endswith('.dcp.docx'):
+        stem, ext = name[:-len('.dcp.docx')], name[-len('.dcp.docx'):]
+    else:
+        stem, ext = os.path.splitext(name)
+    number = 1
+    while arcname.lower() in used:
+        number += 1
+        arcname = f"{stem} ({number}){ext}"
+    used.add(arcname.lower())
+    return arcname
+
+def read_export_file(path):
+    """Contents of a prepared export, read only when its download button is clicked"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def write_export_file(export_dir, prefix, suffix, write):
+    """Create a file in export_dir, fill it with write(file) and return its path, removing it if write fails"""
+    os.makedirs(export_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=export_dir, prefix=f"{prefix}_", suffix=suffix, delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            ExportArtifacts._discard(f.name)
+            raise
+    return f.name
+
+def create_excel_download(metadata, zip_name="matched_files", token_matrix=None, skipped=None,
+                          export_dir=DEFAULT_EXPORTS_DIR, pattern_files=None):
+    """Write the Excel report to a file in export_dir and return its path"""
+    try:
+        return write_export_file(export_dir, zip_name, '.xlsx',
+                                 lambda f: create_excel_report(metadata, token_matrix, skipped, output=f,
+                                                               pattern_files=pattern_files))
+    except Exception as e:
+        st.error(f"Error creating Excel report: {str(e)}")
+        return None
+
+def create_zip_download(matching_files, metadata, zip_name="matched_files", token_matrix=None, skipped=None,
+                        export_dir=DEFAULT_EXPORTS_DIR, pattern_files=None):
+    """Write the ZIP package to a file in export_dir and return its path"""
+    # A .docx is already a zip, so it is stored as is; clashing names get numbered
+    def write_zip(zip_file):
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            # Add Excel metadata file to ZIP
+            with zipf.open('scan_results.xlsx', 'w', force_zip64=True) as report:
+                create_excel_report(metadata, token_matrix, skipped, output=report, pattern_files=pattern_files)
+            
+            # Add matched files
+            used = set()
+            for file_path in matching_files:
+                if os.path.exists(file_path):
+                    arcname = os.path.join('matched_files', unique_arcname(os.path.basename(file_path), used))
+                    compress_type = zipfile.ZIP_STORED if file_path.lower().endswith('.docx') else zipfile.ZIP_DEFLATED
+                    zipf.write(file_path, arcname, compress_type=compress_type)
+    
+    try:
+        return write_export_file(export_dir, zip_name, '.zip', write_zip)
+    except Exception as e:
+        st.error(f"Error creating ZIP: {str(e)}")
+        return None
+
+def make_file_filter(file_type):
+    """Build the file-name filter for a File Types selection"""
+    file_filter_map = {
+        "Only .dcp.docx": lambda f: f.endswith('.dcp.docx'),
+        "Only .docx (excluding .dcp.docx)": lambda f: f.endswith('.docx') and not f.endswith('.dcp.docx'),
+        "Both (.docx and .dcp.docx)": lambda f: f.endswith('.docx')
+    }
+    return file_filter_map.get(file_type, lambda f: f.endswith('.docx'))
+
+def format_file_size(size_bytes):
+    """Format file size in human readable format"""
+    if size_bytes == 0:
+        return "0 B"
+    size_names = ["B", "KB", "MB", "GB"]
+    i = 0
+    while size_bytes >= 1024 and i < len(size_names) - 1:
+        size_bytes /= 1024.0
+        i += 1
+    return f"{size_bytes:.1f} {size_names[i]}"
+
+class DocCount:
+    """Recursive .docx count of one folder, filled in by a background walk"""
+    
+    def __init__(self, path, mtime_ns):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.docx = 0
+        self.samples = []
+        self.complete = False
+        self.finished_at = None
+        self.done = threading.Event()
+    
+    def run(self):
+        """Walk the folder like glob("**/*.docx"), skipping hidden entries and symlinked folders"""
+        stack = [self.path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                                continue
+                            if not entry.name.endswith('.docx') or entry.name.startswith('~') or not entry.is_file():
+                                continue
+                        except OSError:
+                            continue
+                        self.docx += 1
+                        if len(self.samples) < 5:
+                            self.samples.append(entry.path)
+            except OSError:
+                pass  # Unreadable folders are left out of the count
+        self.finished_at = time.monotonic()
+        self.complete = True
+        self.done.set()
+    
+    def label(self):
+        """The count for display, "1,000+" while the walk is still running"""
+        if self.complete:
+            return f"{self.docx:,}"
+        return f"{self.docx:,}+" if self.docx else "…"
+
+class DocCountCache:
+    """Folder browser document counts, computed in the background and reused until the TTL or the folder's mtime changes"""
+    
+    def __init__(self, ttl=DOC_COUNT_TTL, workers=4):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="docxscan-count")
+    
+    def get(self, path, budget=DOC_COUNT_BUDGET):
+        """Return the folder's DocCount, waiting up to budget seconds for it to finish"""
+        path = os.path.abspath(path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        now = time.monotonic()
+        with self._lock:
+            count = self._counts.get(path)
+            if count is None or (count.complete and (count.mtime_ns != mtime_ns or now - count.finished_at > self.ttl)):
+                count = DocCount(path, mtime_ns)
+                self._counts[path] = count
+                self._executor.submit(count.run)
+                self._expire(now)
+        if not count.complete and budget:
+            count.done.wait(budget)
+        return count
+    
+    def get_many(self, paths, budget=DOC_COUNT_BUDGET):
+        """Return the DocCounts of several folders, all counted at once within one shared budget"""
+        counts = [self.get(path, budget=0) for path in paths]
+        deadline = time.monotonic() + budget
+        for count in counts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not count.complete:
+                count.done.wait(remaining)
+        return counts
+    
+    def discard(self, path):
+        """Forget the counts of a folder and everything below it"""
+        path = os.path.abspath(path)
+        with self._lock:
+            for counted in [p for p in self._counts if p == path or p.startswith(os.path.join(path, ''))]:
+                del self._counts[counted]
+    
+    def _expire(self, now):
+        """Drop finished counts past their TTL"""
+        for path in [p for p, c in self._counts.items() if c.complete and now - c.finished_at > self.ttl]:
+            del self._counts[path]
+
+class DiscoverySnapshots:
+    """Discovery snapshots by folder and File Types selection"""
+    
+    def __init__(self, limit=8):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._snapshots = {}
+    
+    def get(self, folder_path, file_type, budget=DOC_COUNT_BUDGET):
+        """Return the folder's snapshot, starting a background walk when there is none"""
+        key = (os.path.abspath(folder_path), file_type)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or (snapshot.complete and snapshot.root_changed()):
+                snapshot = DiscoverySnapshot(key[0], file_type)
+                self._store(key, snapshot)
+                threading.Thread(target=snapshot.build, daemon=True).start()
+        if not snapshot.complete and budget:
+            snapshot.done.wait(budget)
+        return snapshot
+    
+    def put(self, snapshot):
+        """Keep the snapshot a scan's own walk produced"""
+        with self._lock:
+            self._store((os.path.abspath(snapshot.folder_path), snapshot.file_type), snapshot)
+    
+    def _store(self, key, snapshot):
+        self._snapshots.pop(key, None)
+        self._snapshots[key] = snapshot
+        while len(self._snapshots) > self.limit:
+            del self._snapshots[next(iter(self._snapshots))]
+    
+    def discard(self, folder_path):
+        """Forget every snapshot of a folder, e.g. on Refresh or Change Folder"""
+        folder_path = os.path.abspath(folder_path)
+        with self._lock:
+            for key in [key for key in self._snapshots if key[0] == folder_path]:
+                del self._snapshots[key]
+
+@st.cache_resource
+def get_discovery_snapshots():
+    """Discovery snapshots reused across sessions and reruns"""
+    return DiscoverySnapshots()
+
+@st.cache_resource
+def get_doc_counts():
+    """The folder browser's document count cache"""
+    return DocCountCache()
+
+@st.cache_resource
+def get_drive_counts():
+    """Whole-drive document counts, walked one at a time so folder counts never queue behind them"""
+    return DocCountCache(workers=1)
+
+def get_drives_windows():
+    """Get available drives on Windows"""
+    drives = []
+    for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+        drive = f"{letter}:\\"
+        if os.path.exists(drive):
+            drives.append(drive)
+    return drives
+
+def get_recent_folders():
+    """Get recently accessed folders (simple heuristic)"""
+    recent = []
+    user_home = os.path.expanduser("~")
+    
+    # Common recent folder locations
+    potential_folders = [
+        os.path.join(user_home, "Documents"),
+        os.path.join(user_home, "Desktop"),
+        os.path.join(user_home, "Downloads"),
+        os.path.join(user_home, "OneDrive"),
+        os.path.join(user_home, "Google Drive"),
+        os.path.join(user_home, "Dropbox"),
+    ]
+    
+    # Check which contain any .docx files; keep folders still being counted
+    existing = [folder for folder in potential_folders if os.path.exists(folder)]
+    for folder, count in zip(existing, get_doc_counts().get_many(existing)):
+        if count.docx > 0 or not count.complete:
+            recent.append((folder, count))
+    
+    return recent
+
+def smart_path_suggestions(current_input):
+    """Provide intelligent path suggestions based on current input"""
+    if not current_input:
+        return []
+    
+    try:
+        # If it's a partial path, try to complete it
+        if os.path.sep in current_input:
+            parent = os.path.dirname(current_input)
+            if os.path.exists(parent):
+                basename = os.path.basename(current_input).lower()
+                folders = []
+                
+                for item in os.listdir(parent):
+                    full_path = os.path.join(parent, item)
+                    if (os.path.isdir(full_path) and 
+                        item.lower().startswith(basename) and
+                        not item.startswith('.')):
+                        folders.append((full_path, item))
+                
+                # Count docx files in these directories within one budget for the whole list
+                counts = get_doc_counts().get_many([full_path for full_path, _ in folders])
+                items = [(full_path, item, count) for (full_path, item), count in zip(folders, counts)]
+                
+                # Sort by docx count (descending) and name
+                items.sort(key=lambda x: (-x[2].docx, x[1].lower()))
+                return items[:8]  # Limit to 8 suggestions
+        
+        # If it's just a drive letter or root, show top-level directories
         elif current_input.endswith(":\\") or current_input == "/":
             items = []
             try:
-                for item in os.listdir(current_input):
-                    full_path = os.path.join(current_input, item)
-                    if os.path.isdir(full_path) and not item.startswith('.'):
-                        try:
-                            docx_count = len(glob.glob(os.path.join(full_path, "**/*.docx"), recursive=True))
-                            if docx_count > 0:  # Only show folders with documents
-                                items.append((full_path, item, docx_count))
-                        except:
-                            pass
+                folders = [(os.path.join(current_input, item), item) for item in os.listdir(current_input)
+                           if os.path.isdir(os.path.join(current_input, item)) and not item.startswith('.')]
+                counts = get_doc_counts().get_many([full_path for full_path, _ in folders])
+                for (full_path, item), count in zip(folders, counts):
+                    if count.docx > 0 or not count.complete:  # Only show folders with documents
+                        items.append((full_path, item, count))
                 
-                items.sort(key=lambda x: (-x[2], x[1].lower()))
+                items.sort(key=lambda x: (-x[2].docx, x[1].lower()))
                 return items[:8]
             except PermissionError:
                 return []
@@ -1155,21 +4030,19 @@ def render_super_enhanced_folder_browser():
                 if os.path.exists(path):
                     quick_locations.append((name, path))
             
-            # Display quick access buttons
+            # Display quick access buttons, counting every location within one budget
             cols = st.columns(2)
+            existing = [path for _, path in quick_locations if os.path.exists(path)]
+            quick_counts = dict(zip(existing, get_doc_counts().get_many(existing)))
             for i, (name, path) in enumerate(quick_locations):
                 col = cols[i % 2]
                 with col:
                     if os.path.exists(path):
                         # Count documents in this location
-                        try:
-                            docx_count = len(glob.glob(os.path.join(path, "**/*.docx"), recursive=True))
-                            button_text = f"{name}"
-                            if docx_count > 0:
-                                button_text += f" ({docx_count} docs)"
-                        except:
-                            button_text = name
-                            docx_count = 0
+                        count = quick_counts[path]
+                        button_text = f"{name}"
+                        if count.docx > 0 or not count.complete:
+                            button_text += f" ({count.label()} docs)"
                         
                         if st.button(button_text, key=f"quick_{i}", use_container_width=True):
                             st.session_state.selected_folder_path = path
@@ -1190,7 +4063,7 @@ def render_super_enhanced_folder_browser():
                 st.markdown("**Folders containing documents:**")
                 for i, (folder, count) in enumerate(recent_folders[:6]):
                     folder_name = os.path.basename(folder) or folder
-                    if st.button(f"📁 {folder_name} ({count} docs)", key=f"recent_{i}", use_container_width=True):
+                    if st.button(f"📁 {folder_name} ({count.label()} docs)", key=f"recent_{i}", use_container_width=True):
                         st.session_state.selected_folder_path = folder
                         if folder not in st.session_state.path_history:
                             st.session_state.path_history.insert(0, folder)
@@ -1218,19 +4091,16 @@ def render_super_enhanced_folder_browser():
                 st.markdown("**Available Drives:**")
                 
                 drive_cols = st.columns(min(4, len(drives)))
+                drive_counts = get_drive_counts().get_many(drives)
                 for i, drive in enumerate(drives):
                     col = drive_cols[i % len(drive_cols)]
                     with col:
-                        try:
-                            drive_label = f"💾 {drive}"
-                            
-                            # Count documents on this drive
-                            docx_count = len(glob.glob(os.path.join(drive, "**/*.docx"), recursive=True))
-                            if docx_count > 0:
-                                drive_label += f" ({docx_count})"
-                            
-                        except:
-                            drive_label = f"💾 {drive}"
+                        drive_label = f"💾 {drive}"
+                        
+                        # Count documents on this drive; a whole drive usually finishes in the background
+                        count = drive_counts[i]
+                        if count.docx > 0 or not count.complete:
+                            drive_label += f" ({count.label()})"
                         
                         if st.button(drive_label, key=f"drive_{i}", use_container_width=True):
                             st.session_state.current_path_input = drive
@@ -1364,6 +4234,8 @@ def render_folder_browser_interface():
             
             with col2:
                 if st.button("🔄 Refresh", use_container_width=True, key="refresh_browse"):
+                    get_doc_counts().discard(current_path)
+                    get_discovery_snapshots().discard(current_path)
                     st.rerun()
             
             with col3:
@@ -1412,8 +4284,8 @@ def render_manual_path_input():
                 col = suggestion_cols[i % len(suggestion_cols)]
                 with col:
                     display_text = f"📁 {item_name}"
-                    if doc_count > 0:
-                        display_text += f" ({doc_count} docs)"
+                    if doc_count.docx > 0 or not doc_count.complete:
+                        display_text += f" ({doc_count.label()} docs)"
                     
                     if st.button(display_text, key=f"suggest_manual_{i}", use_container_width=True):
                         st.session_state.current_path_input = full_path
@@ -1423,26 +4295,19 @@ def render_manual_path_input():
     path_valid = False
     if current_input:
         if os.path.exists(current_input) and os.path.isdir(current_input):
-            try:
-                # Count documents
-                docx_files = glob.glob(os.path.join(current_input, "**/*.docx"), recursive=True)
-                dcp_files = glob.glob(os.path.join(current_input, "**/*.dcp.docx"), recursive=True)
-                total_docs = len(docx_files) + len(dcp_files)
-                
-                st.success(f"✅ Valid folder with {total_docs} document files")
-                path_valid = True
-                
-                # Show some file examples
-                if total_docs > 0:
-                    with st.expander(f"📄 Preview ({min(5, total_docs)} of {total_docs} files)", expanded=False):
-                        all_files = docx_files + dcp_files
-                        for file_path in all_files[:5]:
-                            file_name = os.path.basename(file_path)
-                            st.caption(f"📄 {file_name}")
-                
-            except Exception as e:
-                st.warning(f"⚠️ Valid path but couldn't scan: {str(e)}")
-                path_valid = True
+            # Count documents
+            count = get_doc_counts().get(current_input)
+            total_docs = count.label()
+            
+            st.success(f"✅ Valid folder with {total_docs} document files")
+            path_valid = True
+            
+            # Show some file examples
+            if count.samples:
+                with st.expander(f"📄 Preview ({len(count.samples)} of {total_docs} files)", expanded=False):
+                    for file_path in count.samples:
+                        file_name = os.path.basename(file_path)
+                        st.caption(f"📄 {file_name}")
         elif os.path.exists(current_input):
             st.error("❌ Path exists but is not a directory")
         else:
@@ -1506,6 +4371,7 @@ def main():
     """Main application"""
     load_css()
     SessionState.init()
+    get_stale_file_sweeper().run()
     
     # Header
     st.markdown("""
@@ -1533,6 +4399,10 @@ def main():
                 token_data = json.load(uploaded_token_file)
                 st.session_state.token_map = token_data
                 st.success(f"✅ Loaded {len(token_data)} tokens")
+                for token in token_data:
+                    error = TokenMatcher.token_error(token)
+                    if error:
+                        st.warning(f"⚠️ Pattern {token} is skipped: {error}")
                 log_message(f"✅ Loaded {len(token_data)} tokens from {uploaded_token_file.name}")
             except Exception as e:
                 st.error(f"❌ Error loading token file: {str(e)}")
@@ -1552,19 +4422,36 @@ def main():
             selected_token = "-- Select Token --"
             st.warning("⚠️ Please upload a token file first")
         
+        # Files-with-matches mode records no counts, so it has no matrix to offer
+        first_hit_on = st.session_state.get("first_hit_checkbox", False)
+        scan_all_tokens = st.checkbox(
+            "🧮 Scan All Tokens",
+            value=False,
+            disabled=not st.session_state.token_map or first_hit_on,
+            help="Scan every loaded token at once and build a file × token count matrix "
+                 "(not available with Files With Matches Only)",
+            key="scan_all_tokens_checkbox"
+        ) and not first_hit_on
+        
         # Custom tokens
         st.markdown("#### ✏️ Custom Tokens")
         custom_tokens = st.text_area(
             "Additional Tokens",
-            help="Enter additional tokens separated by commas",
+            help="Enter additional tokens separated by commas. Prefix a token with re: for a regular "
+                 "expression or glob: for a wildcard (* any run of non-space characters, ? one character) "
+                 "to match a whole family, e.g. glob:PROMTINTO*(",
             placeholder="<<token1>>, [[token2]], {token3}",
             height=80,
             key="custom_tokens_input"
         )
         
         if custom_tokens:
-            token_count = len([t.strip() for t in custom_tokens.split(",") if t.strip()])
-            st.caption(f"📝 {token_count} custom tokens added")
+            token_list = [t.strip() for t in custom_tokens.split(",") if t.strip()]
+            st.caption(f"📝 {len(token_list)} custom tokens added")
+            for token in token_list:
+                error = TokenMatcher.token_error(token)
+                if error:
+                    st.warning(f"⚠️ Pattern {token} is skipped: {error}")
         
         # File type filter
         st.markdown("#### 📁 File Filter")
@@ -1575,6 +4462,104 @@ def main():
             key="file_type_selector"
         )
         
+        # Scan engine
+        st.markdown("#### 🚀 Scan Engine")
+        extractor_map = {
+            "Streaming XML (fast)": "xml",
+            "python-docx (compatible)": "docx"
+        }
+        extractor_choice = st.selectbox(
+            "Text Extraction",
+            list(extractor_map.keys()),
+            help="Streaming XML reads word/document.xml directly and falls back to python-docx for damaged files",
+            key="extractor_selector"
+        )
+        scan_workers = st.number_input(
+            "Parallel Workers",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=1,
+            help="Worker processes used to extract and match documents (1 = scan in-process)",
+            key="scan_workers_input"
+        )
+        use_cache = st.checkbox(
+            "Use Extraction Cache",
+            value=True,
+            help="Reuse extracted text for files whose size and modified time have not changed",
+            key="use_cache_checkbox"
+        )
+        cache_dir = st.text_input(
+            "Cache Directory",
+            value=DEFAULT_CACHE_DIR,
+            disabled=not use_cache,
+            key="cache_dir_input"
+        )
+        cache_max_mb = st.number_input(
+            "Cache Size Limit (MB)",
+            min_value=16,
+            value=512,
+            step=64,
+            disabled=not use_cache,
+            key="cache_max_mb_input"
+        )
+        use_index = st.checkbox(
+            "Answer From Token Index",
+            value=True,
+            help="Answer scans from the folder's token index when it covers the selected tokens (see Build Index)",
+            key="use_index_checkbox"
+        )
+        incremental = st.checkbox(
+            "Rescan Changed Files Only",
+            value=False,
+            help="Reuse hits from the folder's last scan manifest and only re-process added or modified files",
+            key="incremental_checkbox"
+        )
+        first_hit = st.checkbox(
+            "⚡ Files With Matches Only",
+            value=False,
+            help="Stop reading each document at its first match; match counts and lines are left empty",
+            key="first_hit_checkbox"
+        )
+        prefilter = st.checkbox(
+            "🔎 Prefilter Raw XML",
+            value=True,
+            help="Skip full extraction for documents whose raw text cannot contain any selected token "
+                 "(files-with-matches mode only uses it ahead of python-docx)",
+            key="prefilter_checkbox"
+        )
+        file_timeout = st.number_input(
+            "⏱️ Per-File Timeout (s)",
+            min_value=0,
+            value=DEFAULT_SCAN_OPTIONS['file_timeout'],
+            step=30,
+            help="Skip a document whose extraction and matching take longer than this, with either extractor (0 = no limit)",
+            key="file_timeout_input"
+        )
+        max_xml_mb = st.number_input(
+            "📏 Max document.xml Size (MB)",
+            min_value=0,
+            value=DEFAULT_SCAN_OPTIONS['max_xml_mb'],
+            step=32,
+            help="Skip a document whose text part decompresses to more than this, e.g. a zip bomb (0 = no limit)",
+            key="max_xml_mb_input"
+        )
+        scan_options = {
+            'first_hit': first_hit,
+            'prefilter': prefilter,
+            'file_timeout': int(file_timeout),
+            'max_xml_mb': int(max_xml_mb),
+            'extractor': extractor_map[extractor_choice],
+            'workers': int(scan_workers),
+            'cache_dir': cache_dir if use_cache else None,
+            'cache_max_mb': int(cache_max_mb),
+            'manifest_dir': DEFAULT_MANIFEST_DIR,
+            'incremental': incremental,
+            'index_dir': DEFAULT_INDEX_DIR if use_index else None,
+            'use_index': use_index,
+            'checkpoint_dir': DEFAULT_CHECKPOINT_DIR,
+            'file_type': file_type
+        }
+        
         # ZIP output name
         st.markdown("#### 📦 Output Settings")
         zip_name = st.text_input(
@@ -1605,6 +4590,15 @@ def main():
         # Clear console
         if st.button("🧹 Clear Console", use_container_width=True, key="clear_console_btn"):
             clear_console()
+        
+        # Clear extraction cache
+        if st.button("🗑️ Clear Cache", use_container_width=True, key="clear_cache_btn", disabled=not use_cache):
+            cache = open_extraction_cache(scan_options)
+            if cache:
+                cache.clear()
+                cache.close()
+                st.session_state.cache_stats = {'hits': 0, 'misses': 0}
+                log_message("🗑️ Extraction cache cleared")
     
     # Main content area
     col1, col2 = st.columns([2, 1], gap="medium")
@@ -1623,21 +4617,8 @@ def main():
             folder_valid = False
             folder_path = ""
         else:
-            # Show selected folder with file count
-            file_filter_map = {
-                "Only .dcp.docx": lambda f: f.endswith('.dcp.docx'),
-                "Only .docx (excluding .dcp.docx)": lambda f: f.endswith('.docx') and not f.endswith('.dcp.docx'),
-                "Both (.docx and .dcp.docx)": lambda f: f.endswith('.docx')
-            }
-            file_filter = file_filter_map.get(file_type, lambda f: f.endswith('.docx'))
-            
-            # Count files using the enhanced method
-            file_count = 0
-            try:
-                docx_files = glob.glob(os.path.join(st.session_state.selected_folder_path, "**/*.docx"), recursive=True)
-                file_count = len([f for f in docx_files if file_filter(os.path.basename(f))])
-            except:
-                file_count = 0
+            # Show selected folder with file count; the scan reuses this walk while it is current
+            file_count = get_discovery_snapshots().get(st.session_state.selected_folder_path, file_type).label()
             
             # Display selected folder
             st.markdown(f"""
@@ -1650,8 +4631,24 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
+            # Watch mode keeps the folder's cache, manifest and index warm between scans
+            watcher = get_folder_watchers().get(st.session_state.selected_folder_path)
+            if watcher:
+                st.caption(watcher.status_text())
+                if st.button("⏹️ Stop Watching", use_container_width=True, key="stop_watch_btn"):
+                    get_folder_watchers().stop(st.session_state.selected_folder_path)
+                    log_message(f"⏹️ Stopped watching {st.session_state.selected_folder_path}")
+                    st.rerun()
+            elif st.button("👁️ Watch Folder", use_container_width=True, key="watch_folder_btn",
+                           help="Extract .docx files in the background as they are saved so the next scan is instant"):
+                get_folder_watchers().start(st.session_state.selected_folder_path,
+                                            {**scan_options, 'index_dir': DEFAULT_INDEX_DIR})
+                log_message(f"👁️ Watching {st.session_state.selected_folder_path} for changes")
+                st.rerun()
+            
             # Change folder button
             if st.button("🔄 Change Folder", use_container_width=True, key="change_folder_btn"):
+                get_discovery_snapshots().discard(st.session_state.selected_folder_path)
                 st.session_state.selected_folder_path = ""
                 st.session_state.folder_browser_mode = "select"
                 st.rerun()
@@ -1666,13 +4663,19 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        # Progress display
-        progress_placeholder = st.empty()
-        status_placeholder = st.empty()
+        # Progress display, live from the background job while one is running
+        if st.session_state.scan_job_id:
+            render_scan_job()
+        elif st.session_state.scan_progress > 0:
+            st.progress(st.session_state.scan_progress / 100)
+            st.info(f"Status: {st.session_state.scan_status}")
         
-        if st.session_state.scan_progress > 0:
-            progress_placeholder.progress(st.session_state.scan_progress / 100)
-            status_placeholder.info(f"Status: {st.session_state.scan_status}")
+        if st.session_state.scan_notice:
+            kind, notice = st.session_state.scan_notice
+            st.session_state.scan_notice = None
+            getattr(st, kind)(notice)
+            if kind == "success":
+                st.balloons()
         
         # Check if scan can be started
         can_scan = (
@@ -1681,7 +4684,12 @@ def main():
             not st.session_state.scan_running
         )
         
-        col_btn1, col_btn2, col_btn3 = st.columns([2, 1, 1])
+        col_btn1, col_btn_index, col_btn2, col_btn3 = st.columns([2, 1, 1, 1])
+        
+        # Custom tokens
+        custom_list = [t.strip() for t in custom_tokens.split(",") if t.strip()] if custom_tokens else []
+        token_keys = [t for t in st.session_state.token_map if not TokenMatcher.token_error(t)]
+        custom_list = [t for t in custom_list if not TokenMatcher.token_error(t)]
         
         with col_btn1:
             if st.button("🚀 Start Scan", disabled=not can_scan, use_container_width=True, key="start_scan_btn"):
@@ -1689,62 +4697,56 @@ def main():
                     # Prepare patterns
                     patterns = []
                     
-                    # Add selected token
-                    if selected_token != "-- Select Token --":
-                        matched_tokens = [k for k, v in st.session_state.token_map.items() if v == selected_token]
+                    # Add selected token, or every token for a matrix scan
+                    if scan_all_tokens:
+                        patterns.extend(token_keys)
+                    elif selected_token != "-- Select Token --":
+                        matched_tokens = [k for k in token_keys if st.session_state.token_map[k] == selected_token]
                         patterns.extend(matched_tokens)
                     
                     # Add custom tokens
-                    if custom_tokens:
-                        custom_list = [t.strip() for t in custom_tokens.split(",") if t.strip()]
-                        patterns.extend(custom_list)
+                    patterns.extend(custom_list)
                     
                     if patterns:
-                        # Define file filter
-                        file_filter_map = {
-                            "Only .dcp.docx": lambda f: f.endswith('.dcp.docx'),
-                            "Only .docx (excluding .dcp.docx)": lambda f: f.endswith('.docx') and not f.endswith('.dcp.docx'),
-                            "Both (.docx and .dcp.docx)": lambda f: f.endswith('.docx')
-                        }
-                        file_filter = file_filter_map.get(file_type, lambda f: f.endswith('.docx'))
-                        
-                        # Start scan
-                        st.session_state.scan_running = True
-                        
-                        # Create placeholders for real-time updates
-                        console_placeholder = st.empty()
+                        # A matrix scan extracts each document once into the token index
+                        run_options = scan_options
+                        if scan_all_tokens:
+                            run_options = {**scan_options, 'build_index': True, 'index_dir': DEFAULT_INDEX_DIR}
                         
-                        # Execute scan
-                        matching_files, metadata = DocumentScanner.scan_documents(
-                            st.session_state.selected_folder_path,
-                            patterns,
-                            file_filter,
-                            progress_placeholder,
-                            console_placeholder
-                        )
-                        
-                        # Store results
-                        st.session_state.scan_results = metadata
-                        st.session_state.matching_files = matching_files
-                        st.session_state.scan_running = False
-                        
-                        if matching_files:
-                            st.success(f"🎉 Scan completed! Found {len(matching_files)} matching files")
-                            st.balloons()
-                        else:
-                            st.info("ℹ️ Scan completed but no matching files were found")
+                        # Run in the background so the page stays usable during the scan
+                        job = ScanJob("scan", folder_path, patterns, file_type, run_options, matrix=scan_all_tokens,
+                                      discovered=get_discovery_snapshots().get(folder_path, file_type, budget=0),
+                                      owner=st.session_state.owner)
+                        submit_scan_job(job)
+                        st.rerun()
+        
+        with col_btn_index:
+            can_index = st.session_state.selected_folder_path and st.session_state.token_map and not st.session_state.scan_running
+            if st.button("🗂️ Build Index", disabled=not can_index, use_container_width=True, key="build_index_btn",
+                         help="Scan once for every loaded token so later selections are answered instantly"):
+                # Index every loaded token plus any custom tokens
+                index_patterns = token_keys + custom_list
+                job = ScanJob("index", folder_path, index_patterns, file_type,
+                              {**scan_options, 'build_index': True, 'index_dir': DEFAULT_INDEX_DIR},
+                              discovered=get_discovery_snapshots().get(folder_path, file_type, budget=0),
+                              owner=st.session_state.owner)
+                submit_scan_job(job)
+                st.rerun()
         
         with col_btn2:
             if st.button("📊 Results", use_container_width=True, key="results_btn"):
-                if st.session_state.scan_results:
-                    st.info(f"📊 {len(st.session_state.scan_results)} files in results")
+                if st.session_state.result_store:
+                    st.info(f"📊 {len(st.session_state.result_store)} files in results")
                 else:
                     st.warning("No results available")
         
         with col_btn3:
             if st.button("🔄 Reset", use_container_width=True, key="reset_btn"):
-                st.session_state.scan_results = []
-                st.session_state.matching_files = []
+                # A running job keeps going but its results are no longer collected
+                st.session_state.scan_job_id = None
+                st.session_state.scan_running = False
+                replace_result_store(None)
+                st.session_state.token_matrix = None
                 st.session_state.scan_progress = 0
                 st.session_state.scan_status = "Ready to scan"
                 st.session_state.selected_folder_path = ""
@@ -1752,8 +4754,31 @@ def main():
                 clear_console()
                 st.rerun()
         
-        # Results section
-        if st.session_state.scan_results:
+        # Pick up a scan that outlived a page reload, or one interrupted part-way
+        if folder_valid and not st.session_state.scan_running:
+            active_job = get_scan_jobs().active_for(folder_path, st.session_state.owner)
+            checkpoint = (None if active_job
+                          else ScanCheckpoint.load(DEFAULT_CHECKPOINT_DIR, folder_path, st.session_state.owner))
+            if active_job:
+                st.info(f"🧵 A {active_job.kind} job ({active_job.id}) is still running for this folder")
+                if st.button("🔗 Reattach", use_container_width=True, key="reattach_scan_btn"):
+                    st.session_state.scan_job_id = active_job.id
+                    st.session_state.scan_job_cursor = 0
+                    st.session_state.scan_running = True
+                    st.rerun()
+            elif checkpoint:
+                st.warning(f"⏸️ Unfinished {checkpoint.kind} from {checkpoint.saved_at}: "
+                           f"{len(checkpoint.done)} of {len(checkpoint.files)} files done")
+                if st.button("⏯️ Resume Scan", use_container_width=True, key="resume_scan_btn"):
+                    job = ScanJob(checkpoint.kind, folder_path, checkpoint.patterns, checkpoint.file_type,
+                                  checkpoint.options, matrix=checkpoint.matrix, resume=checkpoint,
+                                  owner=st.session_state.owner)
+                    submit_scan_job(job)
+                    st.rerun()
+        
+        # Results section, read from the session's on-disk result store
+        store = st.session_state.result_store
+        if store:
             st.markdown("""
             <div class="modern-card">
                 <div class="card-title">📊 Scan Results <div class="status-indicator"></div></div>
@@ -1764,69 +4789,137 @@ def main():
             col_m1, col_m2, col_m3, col_m4 = st.columns(4)
             
             with col_m1:
-                st.metric("📄 Files Found", len(st.session_state.scan_results))
+                st.metric("📄 Files Found", len(store))
             
             with col_m2:
-                total_matches = sum(result.get('Token Match Count', 0) for result in st.session_state.scan_results)
-                st.metric("🎯 Total Matches", total_matches)
+                st.metric("🎯 Total Matches", store.total_matches)
             
             with col_m3:
-                total_size = sum(result.get('Size (bytes)', 0) for result in st.session_state.scan_results)
-                st.metric("💾 Total Size", format_file_size(total_size))
+                st.metric("💾 Total Size", format_file_size(store.total_size))
             
             with col_m4:
-                unique_patterns = len(set(result.get('Matched Pattern(s)', '') for result in st.session_state.scan_results if result.get('Matched Pattern(s)')))
-                st.metric("🔍 Unique Patterns", unique_patterns)
+                st.metric("🔍 Unique Patterns", store.unique_patterns)
             
-            # Download buttons
+            # Download buttons; exports are built only when asked for and reused until the results change
             col_dl1, col_dl2 = st.columns(2)
+            artifacts = st.session_state.export_artifacts
             
             with col_dl1:
-                if st.session_state.matching_files:
-                    zip_data = create_zip_download(st.session_state.matching_files, st.session_state.scan_results, zip_name)
-                    if zip_data:
-                        st.download_button(
-                            label="📦 Download ZIP Package",
-                            data=zip_data,
-                            file_name=f"{zip_name}.zip",
-                            mime="application/zip",
-                            use_container_width=True,
-                            key="download_zip_btn"
-                        )
+                zip_fingerprint = ExportArtifacts.fingerprint(store, zip_name)
+                zip_path = artifacts.get('zip', zip_fingerprint)
+                if zip_path is None and st.button("📦 Prepare ZIP Package", use_container_width=True,
+                                                  key="prepare_zip_btn"):
+                    with st.spinner("Packaging matched files..."):
+                        # Taken before packaging so edits made meanwhile count as changes
+                        files_fingerprint = ExportArtifacts.files_fingerprint(store.paths())
+                        zip_path = create_zip_download(store.paths(), iter(store), zip_name,
+                                                       st.session_state.token_matrix, store.skipped_rows(),
+                                                       pattern_files=store.pattern_files)
+                    if zip_path:
+                        artifacts.put('zip', zip_fingerprint, zip_path, files_fingerprint)
+                if zip_path:
+                    # Deferred: the file is only read when the button is clicked, not on every rerun
+                    st.download_button(
+                        label="📦 Download ZIP Package",
+                        data=lambda path=zip_path: read_export_file(path),
+                        file_name=f"{zip_name}.zip",
+                        mime="application/zip",
+                        use_container_width=True,
+                        key="download_zip_btn"
+                    )
+                    # Matched files are only stat'ed again on request, not on every rerun
+                    if st.button("🔁 Re-check Matched Files", use_container_width=True, key="recheck_zip_btn"):
+                        if artifacts.files_changed('zip', store.paths()):
+                            log_message("🔁 Matched files changed since the ZIP was built; prepare it again")
+                            st.rerun()
+                        st.info("✅ Matched files are unchanged since the ZIP was built")
             
             with col_dl2:
                 # Excel export
-                excel_buffer = BytesIO()
-                df = pd.DataFrame(st.session_state.scan_results)
-                df.to_excel(excel_buffer, index=False, engine='openpyxl')
-                excel_buffer.seek(0)
-                
-                st.download_button(
-                    label="📊 Download Excel Report",
-                    data=excel_buffer.getvalue(),
-                    file_name=f"{zip_name}_report.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                    key="download_excel_btn"
-                )
+                excel_fingerprint = ExportArtifacts.fingerprint(store)
+                excel_path = artifacts.get('excel', excel_fingerprint)
+                if excel_path is None and st.button("📊 Prepare Excel Report", use_container_width=True,
+                                                    key="prepare_excel_btn"):
+                    with st.spinner("Building Excel report..."):
+                        excel_path = create_excel_download(iter(store), zip_name, st.session_state.token_matrix,
+                                                           store.skipped_rows(), pattern_files=store.pattern_files)
+                    if excel_path:
+                        artifacts.put('excel', excel_fingerprint, excel_path)
+                if excel_path:
+                    st.download_button(
+                        label="📊 Download Excel Report",
+                        data=lambda path=excel_path: read_export_file(path),
+                        file_name=f"{zip_name}_report.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True,
+                        key="download_excel_btn"
+                    )
+            
+            # Typed data exports for loading into analytics jobs
+            export_columns = st.columns(len(DATA_EXPORT_FORMATS))
+            for export_column, (kind, (label, suffix, mime, _)) in zip(export_columns, DATA_EXPORT_FORMATS.items()):
+                with export_column:
+                    export_fingerprint = ExportArtifacts.fingerprint(store)
+                    export_path = artifacts.get(kind, export_fingerprint)
+                    if export_path is None and st.button(f"🧾 Prepare {label}", use_container_width=True,
+                                                         key=f"prepare_{kind}_btn"):
+                        with st.spinner(f"Writing {label} export..."):
+                            export_path = create_data_export(kind, iter(store), zip_name)
+                        if export_path:
+                            artifacts.put(kind, export_fingerprint, export_path)
+                    if export_path:
+                        st.download_button(
+                            label=f"🧾 Download {label}",
+                            data=lambda path=export_path: read_export_file(path),
+                            file_name=f"{zip_name}_results{suffix}",
+                            mime=mime,
+                            use_container_width=True,
+                            key=f"download_{kind}_btn"
+                        )
             
             # Detailed results
             with st.expander("📋 Detailed Results", expanded=False):
+                # Only the current page of rows is read from the store
+                page_count = (len(store) - 1) // RESULTS_PAGE_SIZE + 1
+                page = 1
+                if page_count > 1:
+                    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1,
+                                           key="results_page_input")
+                start = (page - 1) * RESULTS_PAGE_SIZE
+                rows = store.page(start, start + RESULTS_PAGE_SIZE)
+                st.caption(f"Rows {start + 1}–{start + len(rows)} of {len(store)}")
+                
                 # Display columns selection
-                all_columns = list(st.session_state.scan_results[0].keys())
+                all_columns = list(rows[0].keys()) if rows else []
                 display_columns = ['File Name', 'Matched Pattern(s)', 'Token Match Count', 'Size (bytes)', 'Modified Date']
                 available_columns = [col for col in display_columns if col in all_columns]
                 
-                if available_columns:
-                    results_df = pd.DataFrame(st.session_state.scan_results)
+                if not rows:
+                    st.warning("⚠️ The result rows are no longer on disk; run the scan again")
+                elif available_columns:
+                    results_df = pd.DataFrame(rows)
                     st.dataframe(
                         results_df[available_columns],
                         use_container_width=True,
                         height=400
                     )
                 else:
-                    results_df = pd.DataFrame(st.session_state.scan_results)
+                    results_df = pd.DataFrame(rows)
                     st.dataframe(results_df, use_container_width=True, height=400)
+            
+            # Files that went over their size or time budget
+            if store.skipped:
+                with st.expander(f"⏭️ Skipped Files ({len(store.skipped)})", expanded=False):
+                    st.caption("Not scanned: over the document.xml size limit or the per-file timeout")
+                    st.dataframe(pd.DataFrame(store.skipped_rows()), use_container_width=True)
+            
+            # Token matrix from an all-tokens scan
+            if st.session_state.token_matrix is not None:
+                with st.expander("🧮 Token Matrix", expanded=False):
+                    matrix = st.session_state.token_matrix
+                    used = matrix.loc[:, (matrix > 0).any(axis=0)]
+                    st.caption(f"{matrix.shape[0]} files × {matrix.shape[1]} tokens ({used.shape[1]} tokens in use)")
+                    st.dataframe(used, use_container_width=True, height=400)
     
     with col2:
         # Console section
@@ -1837,11 +4930,10 @@ def main():
         """, unsafe_allow_html=True)
         
         # Console display
-        console_text = '\n'.join(st.session_state.console_messages[-15:])  # Show last 15 messages
-        st.markdown(
-            f'<div class="console-area">{console_text}</div>',
-            unsafe_allow_html=True
-        )
+        console_level = st.selectbox("Console level", list(ConsoleLog.LEVELS), index=1, key="console_level_select",
+                                     help=f"Lower levels are still written to {DEFAULT_LOG_PATH}")
+        st.session_state.console.level = ConsoleLog.LEVELS[console_level]
+        st.session_state.console.render(st.empty(), 15)  # Show last 15 messages
         
         # System information
         st.markdown("### 💻 System Status")
@@ -1849,9 +4941,13 @@ def main():
         status_info = {
             "🐍 Python Version": f"{os.sys.version_info.major}.{os.sys.version_info.minor}.{os.sys.version_info.micro}",
             "⏰ Current Time": datetime.now().strftime('%H:%M:%S'),
-            "📊 Console Lines": len(st.session_state.console_messages),
+            "📊 Console Lines": len(st.session_state.console),
             "🔧 Tokens Loaded": len(st.session_state.token_map),
-            "📄 Results Cached": len(st.session_state.scan_results)
+            "📄 Results Stored": len(st.session_state.result_store or ()),
+            "🗄️ Cache Hits": st.session_state.cache_stats['hits'],
+            "🗄️ Cache Misses": st.session_state.cache_stats['misses'],
+            "🔎 Prefilter Skips": st.session_state.prefilter_rejected,
+            "⏭️ Budget Skips": st.session_state.budget_skipped
         }
         
         for label, value in status_info.items():
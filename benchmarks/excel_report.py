@@ -0,0 +1,101 @@
+"""Benchmark the Excel report writer against the old pandas path
+
+Generates synthetic scan rows into a result store on disk, then times each writer
+and records its peak traced memory. The old path builds a DataFrame of every row
+and writes it with pandas' openpyxl engine; the new one streams the rows into a
+write-only workbook. Times include tracemalloc's overhead, which slows both alike.
+
+    python benchmarks/excel_report.py --rows 10000 100000 1000000
+
+The old path needs minutes and several GB of memory at 1M rows; pass
+--legacy-max 100000 to skip it above that size.
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DocXScan-Web.py")
+
+def load_app():
+    """Import DocXScan-Web.py as a module without starting the Streamlit UI"""
+    spec = importlib.util.spec_from_file_location("docxscan_web", APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = [APP_PATH]
+    try:
+        spec.loader.exec_module(app)
+    finally:
+        sys.argv = argv
+    return app
+
+def fill_store(app, results_dir, rows):
+    """Write rows shaped like real scan results into a result store"""
+    patterns = ["<<FileService.", "<<jfig", "jfig", "<<Special.", "PROMTINTO(", "{ATTY"]
+    random.seed(rows)
+    store = app.ResultStore.create(results_dir, f"bench_{rows}")
+    for ordinal in range(rows):
+        folder = f"/srv/share/client{ordinal % 97}/matter{ordinal % 13}"
+        matched = random.sample(patterns, random.randint(1, 3))
+        store.add(ordinal, {
+            'File Name': f"document{ordinal}.docx",
+            'File Path': f"{folder}/document{ordinal}.docx",
+            'Size (bytes)': random.randint(10_000, 2_000_000),
+            'Creation Date': "2025-01-02 03:04:05",
+            'Modified Date': f"2025-{ordinal % 12 + 1:02d}-15 12:00:00",
+            'Matched Pattern(s)': ', '.join(matched),
+            'Matched Line(s)': ' | '.join(f"Dear {p}Client.Name>> regarding file {ordinal}" for p in matched),
+            'Token Match Count': random.randint(1, 40)
+        }, matched)
+    store.finalize()
+    return store
+
+def legacy_report(store, output):
+    """The report as it was written before the streaming writer"""
+    excel_buffer = BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        pd.DataFrame(iter(store)).to_excel(writer, index=False)
+    output.write(excel_buffer.getvalue())
+
+def measure(write, path):
+    """Run write(file) and return (seconds, peak traced MB, output MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, 'wb') as f:
+        write(f)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, os.path.getsize(path) / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max', type=int, default=None,
+                        help="Largest row count to run the old pandas path for")
+    args = parser.parse_args()
+
+    app = load_app()
+    print(f"{'rows':>9}  {'writer':<10} {'seconds':>8} {'peak MB':>8} {'file MB':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            store = fill_store(app, work_dir, rows)
+            writers = [("streaming", lambda f: app.create_excel_report(
+                iter(store), output=f, pattern_files=store.pattern_files))]
+            if args.legacy_max is None or rows <= args.legacy_max:
+                writers.append(("pandas", lambda f: legacy_report(store, f)))
+            for name, write in writers:
+                elapsed, peak, size = measure(write, os.path.join(work_dir, f"{name}_{rows}.xlsx"))
+                print(f"{rows:>9,}  {name:<10} {elapsed:>8.1f} {peak:>8.1f} {size:>8.1f}", flush=True)
+            store.delete()
+
+if __name__ == "__main__":
+    main()